@@ -0,0 +1,298 @@
+### Benchmarks of each generation stage and of end-to-end datagen.py runs, over fixed seeds and a grid of
+### customer counts, date ranges and worker counts. Every case runs in a fresh process, so its peak RSS is its own.
+###
+###   python benchmark.py run -o bench.json --customers 100 1000 --days 30 365 --workers 1 4
+###   python benchmark.py compare baseline.json bench.json --threshold 0.1
+###
+### Run it from the repository root, like the scripts.
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+BENCHMARK_VERSION = 1
+config = './profiles/main_config.json'
+start_date = datetime(2023, 1, 1)
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_profile_objs():
+    with open(config, 'r') as f:
+        names = list(json.load(f))
+    objs = []
+    for name in names:
+        with open(os.path.join('profiles', name), 'r') as f:
+            objs.append(json.load(f))
+    return names, objs
+
+
+def make_customers(n, seed):
+    from datagen_customer import Customer
+    customers, city_rows = Customer(config, seed).generate_customers_batch(n)
+    return customers, city_rows
+
+
+def static_tables(n, seed, city_rows):
+    from datagen_customer import ActivatedCities
+    from datagen_static_merchants import generate_merchants
+    from datagen_transaction import merchants_from_rows
+    activated = ActivatedCities()
+    activated.add_rows(city_rows)
+    return merchants_from_rows(generate_merchants(n, activated, seed=seed), static=True)
+
+
+# every stage gets (customers, days, seed), does its setup and returns (timed seconds, rows processed)
+
+def bench_customer(customers, days, seed):
+    from datagen_customer import Customer
+    c = Customer(config, seed)
+    t = time.perf_counter()
+    for _ in range(customers):
+        c.generate_customer()
+    return time.perf_counter() - t, customers
+
+
+def bench_customer_batch(customers, days, seed):
+    from datagen_customer import Customer
+    c = Customer(config, seed)
+    t = time.perf_counter()
+    c.generate_customers_batch(customers)
+    return time.perf_counter() - t, customers
+
+
+def bench_profile_init(customers, days, seed):
+    from profile_weights import Profile
+    _, objs = load_profile_objs()
+    t = time.perf_counter()
+    for i in range(customers):
+        Profile({**objs[i % len(objs)]})
+    return time.perf_counter() - t, customers
+
+
+def bench_set_date_range(customers, days, seed):
+    from profile_weights import Profile
+    _, objs = load_profile_objs()
+    profiles = [Profile({**obj}) for obj in objs]
+    t = time.perf_counter()
+    for i in range(customers):
+        profiles[i % len(profiles)].set_date_range(start_date, start_date + timedelta(days=days))
+    return time.perf_counter() - t, customers
+
+
+def bench_sample_from(customers, days, seed):
+    from profile_weights import Profile
+    _, objs = load_profile_objs()
+    profiles = [Profile({**obj}) for obj in objs]
+    for profile in profiles:
+        profile.set_date_range(start_date, start_date + timedelta(days=days))
+    rng = np.random.default_rng(seed)
+    rows = 0
+    t = time.perf_counter()
+    for i in range(customers):
+        rows += len(profiles[i % len(profiles)].sample_from(0, rng)[0]['unix_time'])
+    return time.perf_counter() - t, rows
+
+
+def radius_queries(customers, seed, use_grid):
+    from datagen_static_merchants import brick_and_mortar
+    from datagen_transaction import get_list_terminals_within_radius
+    rows, city_rows = make_customers(customers, seed)
+    table, grids = static_tables(customers, seed, city_rows)
+    t = time.perf_counter()
+    for row in rows:
+        for cate in brick_and_mortar:
+            get_list_terminals_within_radius(row[9], row[10], table[cate], 0.5, grids[cate] if use_grid else None)
+    return time.perf_counter() - t, customers * len(brick_and_mortar)
+
+
+def bench_radius_scan(customers, days, seed):
+    return radius_queries(customers, seed, False)
+
+
+def bench_radius_grid(customers, days, seed):
+    return radius_queries(customers, seed, True)
+
+
+def print_trans(customers, days, seed, static):
+    from datagen_transaction import Customer, load_merchants, load_profiles
+    from sinks import TextSink
+    rows, city_rows = make_customers(customers, seed)
+    table, grids = static_tables(customers, seed, city_rows) if static else load_merchants(False)
+    names, _ = load_profile_objs()
+    profiles = {}
+    batches = []
+    rng = np.random.default_rng(seed)
+    for row in rows:
+        cust = Customer("|".join(row), table, grids)
+        if row[-1] not in names:
+            continue
+        profile, _ = load_profiles(pathlib.Path('profiles', row[-1]), start_date, start_date + timedelta(days=days), profiles)
+        batches.append((cust, profile.sample_from(0, rng)))
+    sink = TextSink(os.devnull)
+    written = 0
+    t = time.perf_counter()
+    for cust, trans in batches:
+        cols = cust.build_trans(trans, 0, [], static, False, rng)
+        sink.write_transactions(cust, cols)
+        written += len(cols['unix_time'])
+    sink.close()
+    return time.perf_counter() - t, written
+
+
+def bench_print_trans(customers, days, seed):
+    return print_trans(customers, days, seed, False)
+
+
+def bench_print_trans_static(customers, days, seed):
+    return print_trans(customers, days, seed, True)
+
+
+def bench_datagen(customers, days, seed, workers):
+    # end-to-end datagen.py in a scratch folder (reference data linked in), rows taken from its run manifest
+    from manifests import load_run_manifest, run_manifest_name
+    tmp = tempfile.mkdtemp(prefix='bench_')
+    try:
+        for name in ['profiles', 'demographic_stats']:
+            os.symlink(os.path.abspath(name), os.path.join(tmp, name))
+        os.makedirs(os.path.join(tmp, 'customers_merchants'))
+        os.symlink(os.path.abspath('customers_merchants/merchants.csv'), os.path.join(tmp, 'customers_merchants', 'merchants.csv'))
+        end_date = start_date + timedelta(days=days)
+        cmd = [sys.executable, os.path.join(repo_dir, 'datagen.py'), '-n', str(customers), '-seed', str(seed),
+               start_date.strftime('%m-%d-%Y'), end_date.strftime('%m-%d-%Y'), '-o', 'out', '-b', '10000', '-w',
+               '--workers', str(workers), '--profile_cache', 'none']
+        t = time.perf_counter()
+        subprocess.run(cmd, cwd=tmp, check=True, stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - t
+        # only the transaction chunks: the output folder also holds the run manifest
+        manifest = load_run_manifest(os.path.join(tmp, 'out', run_manifest_name()))
+        rows = sum(entry['rows'] for entries in manifest['completed'].values() for entry in entries)
+        return seconds, rows
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+stages = {
+    'customer': bench_customer,
+    'customer_batch': bench_customer_batch,
+    'profile_init': bench_profile_init,
+    'set_date_range': bench_set_date_range,
+    'sample_from': bench_sample_from,
+    'radius_scan': bench_radius_scan,
+    'radius_grid': bench_radius_grid,
+    'print_trans': bench_print_trans,
+    'print_trans_static': bench_print_trans_static,
+    'datagen': bench_datagen,
+}
+
+
+def run_case(stage, customers, days, seed, workers):
+    # runs in its own process; peak RSS includes the child processes of the end-to-end runs
+    args = (customers, days, seed) + ((workers,) if stage == 'datagen' else ())
+    # no compiled date ranges from a previous run (disk cache) or case (memo), so timings do not depend on them
+    import profile_weights
+    profile_weights.cache_dir = None
+    profile_weights.compiled_ranges.clear()
+    seconds, rows = stages[stage](*args)
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return seconds, rows, peak_kb / 1024
+
+
+def run(stage_names, customer_counts, day_counts, worker_counts, seed=42, repeat=1):
+    results = []
+    for stage in stage_names:
+        for customers in customer_counts:
+            for days in day_counts:
+                for workers in (worker_counts if stage == 'datagen' else [None]):
+                    runs = []
+                    for _ in range(repeat):
+                        with Pool(1) as p: # fresh process per run
+                            runs.append(p.apply(run_case, (stage, customers, days, seed, workers)))
+                    seconds, rows, peak_mb = min(runs) # best of the repeats
+                    result = {
+                        'stage': stage, 'customers': customers, 'days': days, 'workers': workers,
+                        'seconds': round(seconds, 6), 'rows': rows,
+                        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+                        'peak_rss_mb': round(max(r[2] for r in runs), 1),
+                    }
+                    print(f"{stage:<20} customers={customers:<7} days={days:<5} workers={str(workers):<5} "
+                          f"{result['rows_per_sec'] or 0:>12.0f} rows/s {result['peak_rss_mb']:>8.1f} MB")
+                    results.append(result)
+    return {
+        'version': BENCHMARK_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': cpu_count(),
+        'seed': seed,
+        'results': results,
+    }
+
+
+def case_key(result):
+    return result['stage'], result['customers'], result['days'], result['workers']
+
+
+def compare(baseline, current, threshold=0.1):
+    # regressions of current against baseline: throughput down or peak RSS up by more than threshold
+    base = {case_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        ref = base.get(case_key(result))
+        if ref is None:
+            continue
+        speed = result['rows_per_sec'] / ref['rows_per_sec'] if ref['rows_per_sec'] and result['rows_per_sec'] else None
+        memory = result['peak_rss_mb'] / ref['peak_rss_mb'] if ref['peak_rss_mb'] else None
+        flags = []
+        if speed is not None and speed < 1 - threshold:
+            flags.append('SLOWER')
+        if memory is not None and memory > 1 + threshold:
+            flags.append('MORE MEMORY')
+        print(f"{result['stage']:<20} customers={result['customers']:<7} days={result['days']:<5} workers={str(result['workers']):<5} "
+              f"speed x{speed or 0:.2f} memory x{memory or 0:.2f} {' '.join(flags)}")
+        if flags:
+            regressions.append((result, ref, flags))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sparkov: generation benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Run the benchmarks and write the results')
+    run_parser.add_argument('-o', '--output', help='Results file', default='benchmark.json')
+    run_parser.add_argument('--stages', nargs='+', choices=list(stages), help='Stages to run (default: all)', default=list(stages))
+    run_parser.add_argument('--customers', nargs='+', type=int, help='Customer counts', default=[100, 1000])
+    run_parser.add_argument('--days', nargs='+', type=int, help='Date range lengths in days', default=[30, 365])
+    run_parser.add_argument('--workers', nargs='+', type=int, help='Worker counts of the end-to-end runs', default=[1, cpu_count()])
+    run_parser.add_argument('-seed', type=int, help='Random generator seed', default=42)
+    run_parser.add_argument('--repeat', type=int, help='Runs per case, the fastest is kept', default=1)
+    compare_parser = commands.add_parser('compare', help='Flag regressions against a baseline')
+    compare_parser.add_argument('baseline', help='Baseline results file')
+    compare_parser.add_argument('current', help='Results file to check')
+    compare_parser.add_argument('--threshold', type=float, help='Tolerated relative slowdown / memory growth', default=0.1)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run(args.stages, args.customers, args.days, args.workers, args.seed, args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"-> {args.output}")
+    else:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r') as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        print(f"{len(regressions)} regression(s)")
+        exit(1 if regressions else 0)
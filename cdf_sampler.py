@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class CDFSampler:
+    # Weighted sampler over a contiguous cdf array: uniforms are mapped to label indices with np.searchsorted,
+    # so a draw of n values costs O(n log k) instead of one pass over the n values per key.
+
+    def __init__(self, labels, weights):
+        weights = np.asarray(weights, dtype=float)
+        self.labels = labels
+        self.cdf = np.cumsum(weights) / weights.sum()
+
+    @classmethod
+    def from_weights(cls, weights):
+        # {label: weight} dict, as found in the profile json files
+        return cls(list(weights.keys()), list(weights.values()))
+
+    @classmethod
+    def from_cumsum(cls, cumsum):
+        # {cumulative proportion: label} dict, as read from the demographic_stats files
+        keys = sorted(cumsum.keys())
+        sampler = cls.__new__(cls)
+        sampler.labels = [cumsum[k] for k in keys]
+        sampler.cdf = np.array(keys, dtype=float)
+        return sampler
+
+    def __len__(self):
+        return len(self.cdf)
+
+    def indices(self, u):
+        # index of the first cdf entry >= u, clipped so rounding on the last cumsum never overflows
+        return np.minimum(np.searchsorted(self.cdf, u, side='left'), len(self.cdf) - 1)
+
+    def sample_index(self, n, rng=np.random):
+        return self.indices(rng.random(n))
+
+    def sample(self, n, rng=np.random):
+        labels = self.labels
+        return [labels[i] for i in self.sample_index(n, rng)]
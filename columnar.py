@@ -0,0 +1,118 @@
+### Columnar binary output: one directory per chunk, one .npy file per column plus a schema.json.
+### Numeric columns are typed arrays, low-cardinality strings are dictionary-encoded (int32 codes + dictionary),
+### other strings are fixed-width utf-8 bytes. Reading memory-maps the .npy files, so nothing is copied.
+### Only needs NumPy.
+
+import json
+import os
+
+import numpy as np
+
+from sinks import atomic_directory
+
+FORMAT_VERSION = 1
+
+# column kinds and how values are stored
+kinds = {
+    'float': np.float64,
+    'int': np.int64,
+    'int32': np.int32,
+    'int8': np.int8,
+    'date': 'datetime64[D]',
+    'text': None, # fixed-width bytes, width of the longest value
+    'dict': None, # int32 codes into a dictionary of distinct values
+}
+
+
+class ColumnarWriter:
+    # schema: list of (column name, kind). Batches are buffered and written on close().
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.batches = {name: [] for name, _ in schema}
+        self.rows = 0
+
+    def write(self, columns, n):
+        # columns: name -> array/list of n values, or a scalar repeated n times
+        for name, kind in self.schema:
+            values = columns[name]
+            if np.ndim(values) == 0:
+                values = [values] * n
+            if kind == 'text':
+                values = np.array([str(v).encode() for v in values], dtype='S')
+            elif kind == 'dict':
+                values = np.array(values, dtype=object)
+            else:
+                values = np.asarray(values).astype(kinds[kind])
+            self.batches[name].append(values)
+        self.rows += n
+
+    def close(self):
+        # write into a temporary directory first so readers never see a half-written chunk
+        meta = {'version': FORMAT_VERSION, 'rows': self.rows, 'columns': {}}
+        with atomic_directory(self.path) as tmp_path:
+            for name, kind in self.schema:
+                batches = self.batches[name]
+                if kind == 'dict':
+                    values = np.concatenate(batches) if batches else np.empty(0, dtype=object)
+                    dictionary, codes = np.unique(values.astype(str), return_inverse=True)
+                    np.save(os.path.join(tmp_path, f'{name}.npy'), codes.astype(np.int32))
+                    np.save(os.path.join(tmp_path, f'{name}.dict.npy'), dictionary)
+                else:
+                    width = max([b.dtype.itemsize for b in batches], default=1) if kind == 'text' else None
+                    dtype = f'S{width}' if kind == 'text' else kinds[kind]
+                    values = np.concatenate([b.astype(dtype) for b in batches]) if batches else np.empty(0, dtype=dtype)
+                    np.save(os.path.join(tmp_path, f'{name}.npy'), values)
+                meta['columns'][name] = {'kind': kind, 'file': f'{name}.npy'}
+            with open(os.path.join(tmp_path, 'schema.json'), 'w') as f:
+                json.dump(meta, f, indent=1)
+        self.batches = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class ColumnarReader:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'schema.json'), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported columnar format version {meta["version"]} in {path}')
+        self.rows = meta['rows']
+        self.schema = meta['columns']
+
+    @property
+    def columns(self):
+        return list(self.schema)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        # raw column, memory-mapped (dictionary-encoded columns return their int32 codes)
+        return np.load(os.path.join(self.path, self.schema[name]['file']), mmap_mode='r')
+
+    def dictionary(self, name):
+        return np.load(os.path.join(self.path, f'{name}.dict.npy'))
+
+    def decode(self, name):
+        # values of a column as a new array: dictionary lookups or utf-8 decoded text
+        kind = self.schema[name]['kind']
+        if kind == 'dict':
+            return self.dictionary(name)[self[name]]
+        if kind == 'text':
+            return np.char.decode(self[name], 'utf-8')
+        return np.array(self[name])
+
+
+def read_columnar(path):
+    # name -> memory-mapped array for every column of a chunk
+    reader = ColumnarReader(path)
+    return {name: reader[name] for name in reader.columns}
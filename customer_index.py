@@ -0,0 +1,134 @@
+### Sidecar index for the pipe-delimited customer file, so transaction workers can seek() to their range
+### instead of re-reading the whole file.
+### customers.csv.idx.npy holds one (offset, profile) record per customer row plus an end-of-file sentinel,
+### customers.csv.idx.json holds the profile names and the signature (size, mtime, hash of its ends) of the indexed file.
+### Offsets are positions in the uncompressed stream, compressed customer files work too (seeking is slower).
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from sinks import open_file, atomic_write
+
+index_dtype = np.dtype([('offset', np.int64), ('profile', np.int16)])
+
+
+signature_keys = ('file_size', 'file_mtime_ns', 'file_ends_sha1')
+
+
+def file_signature(path, sample_size=1 << 16):
+    # size, modification time and hash of the first and last bytes of a file on disk, recorded with an index or
+    # store built from it: a file rewritten since then (even with the same size) no longer matches
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample_size))
+        f.seek(max(stat.st_size - sample_size, 0))
+        digest.update(f.read(sample_size))
+    return dict(zip(signature_keys, (stat.st_size, stat.st_mtime_ns, digest.hexdigest())))
+
+
+def index_paths(customer_file):
+    return f'{customer_file}.idx.npy', f'{customer_file}.idx.json'
+
+
+class CustomerIndexBuilder:
+    # collects row offsets while the customer file is being written (or scanned)
+
+    def __init__(self, header_length):
+        self.offsets = []
+        self.profiles = []
+        self.profile_ids = {}
+        self.position = header_length
+
+    def add(self, line, profile):
+        # line: the encoded row including its trailing newline
+        self.offsets.append(self.position)
+        self.profiles.append(self.profile_ids.setdefault(profile, len(self.profile_ids)))
+        self.position += len(line)
+
+    def save(self, customer_file):
+        rows = np.empty(len(self.offsets) + 1, dtype=index_dtype)
+        rows['offset'][:-1] = self.offsets
+        rows['profile'][:-1] = self.profiles
+        rows[-1] = (self.position, -1) # sentinel: end of the last row
+        meta = {
+            'profiles': sorted(self.profile_ids, key=self.profile_ids.get),
+            **file_signature(customer_file), # on disk, to detect a stale index
+        }
+        npy_path, json_path = index_paths(customer_file)
+        # a concurrent reader never sees a partial index
+        with atomic_write(npy_path, 'wb') as f:
+            np.save(f, rows)
+        with atomic_write(json_path) as f:
+            json.dump(meta, f)
+
+
+class CustomerIndex:
+
+    def __init__(self, customer_file):
+        npy_path, json_path = index_paths(customer_file)
+        with open(json_path, 'r') as f:
+            meta = json.load(f)
+        self.customer_file = customer_file
+        self.profiles = meta['profiles']
+        self.signature = {key: meta.get(key) for key in signature_keys}
+        self.rows = np.load(npy_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.rows) - 1
+
+    def profile_id(self, profile_name):
+        return self.profiles.index(profile_name) if profile_name in self.profiles else -1
+
+    def profile_counts(self):
+        # number of customers per profile name
+        counts = np.bincount(self.rows['profile'][:-1], minlength=len(self.profiles))
+        return dict(zip(self.profiles, counts.tolist()))
+
+    def profile_rows(self, profile_name, start=0, end=None):
+        # row ids (0-based, header excluded) of the customers of a profile, within rows start..end inclusive
+        end = len(self) - 1 if end is None else min(end, len(self) - 1)
+        ids = np.flatnonzero(self.rows['profile'][start:end + 1] == self.profile_id(profile_name))
+        return ids + start
+
+    def read_rows(self, start, end, profile_name=None):
+        # decoded rows start..end (inclusive), optionally only those of one profile.
+        # One seek and one read for the whole range, rows are then sliced out of the buffer.
+        end = min(end, len(self) - 1)
+        if start > end:
+            return []
+        offsets = self.rows['offset'][start:end + 2]
+        with open_file(self.customer_file, 'rb') as f:
+            f.seek(offsets[0])
+            buf = f.read(offsets[-1] - offsets[0])
+        rel = (offsets - offsets[0]).tolist()
+        if profile_name is None:
+            ids = range(end - start + 1)
+        else:
+            ids = self.profile_rows(profile_name, start, end) - start
+        return [buf[rel[i]:rel[i + 1]].decode() for i in ids]
+
+
+def build_customer_index(customer_file):
+    # one streaming pass over an existing customer file
+    with open_file(customer_file, 'rb') as f:
+        header = f.readline()
+        profile_col = header.decode().rstrip('\r\n').split('|').index('profile')
+        builder = CustomerIndexBuilder(len(header))
+        for line in f:
+            builder.add(line, line.decode().rstrip('\r\n').split('|')[profile_col])
+    builder.save(customer_file)
+
+
+def load_customer_index(customer_file):
+    # load the sidecar index, (re)building it when it is missing or does not match the customer file
+    npy_path, json_path = index_paths(customer_file)
+    if os.path.exists(npy_path) and os.path.exists(json_path):
+        index = CustomerIndex(customer_file)
+        if index.signature == file_signature(customer_file):
+            return index
+    build_customer_index(customer_file)
+    return CustomerIndex(customer_file)
@@ -0,0 +1,178 @@
+### Binary customer store next to the pipe-delimited customer file, so transaction workers skip parsing it.
+### customers.csv.store.npy holds one record per customer: typed lat/long/city_pop/dob/profile columns, and the int32
+### codes of the text of every column (but profile) into an interned string table. The table is
+### customers.csv.store.strings.npy (utf-8 bytes of the distinct strings of each column in order of first appearance,
+### newline terminated) with customers.csv.store.offsets.npy (start of every string, plus the end); codes are relative
+### to the first string of their column. customers.csv.store.json holds these column bases, the profile names and the
+### signature of the customer file the store was built from (see customer_index.file_signature).
+### Everything is memory-mapped, so the workers share the pages; strings are only decoded for the rows being output.
+
+import json
+import os
+
+import numpy as np
+
+from customer_index import file_signature, signature_keys
+from sinks import open_file, atomic_write
+
+STORE_VERSION = 1
+
+columns = [
+    'ssn', 'cc_num', 'first', 'last', 'gender', 'street', 'city', 'state', 'zip',
+    'lat', 'long', 'city_pop', 'job', 'dob', 'acct_num', 'profile'
+]
+# columns also stored as values, to filter or compute on them without parsing text
+typed_columns = {'lat': np.float64, 'long': np.float64, 'city_pop': np.int64, 'dob': 'datetime64[D]'}
+# columns kept as their exact text, the profile is given by its id
+text_columns = columns[:-1]
+
+record_dtype = np.dtype(
+    [(name, dtype) for name, dtype in typed_columns.items()]
+    + [('profile', np.int16), ('text', np.int32, (len(text_columns),))]
+)
+
+
+def store_paths(customer_file):
+    return {
+        'rows': f'{customer_file}.store.npy',
+        'strings': f'{customer_file}.store.strings.npy',
+        'offsets': f'{customer_file}.store.offsets.npy',
+        'meta': f'{customer_file}.store.json',
+    }
+
+
+class CustomerStoreBuilder:
+    # collects customer rows (sequences of column strings, in the order of columns) while they are written
+
+    def __init__(self):
+        self.strings = {name: {} for name in text_columns} # per column, interned string -> code
+        self.profile_ids = {}
+        self.batches = []
+
+    def add_rows(self, rows):
+        records = np.empty(len(rows), dtype=record_dtype)
+        for j, name in enumerate(text_columns):
+            strings = self.strings[name]
+            records['text'][:, j] = [strings.setdefault(row[j], len(strings)) for row in rows]
+        for name, dtype in typed_columns.items():
+            i = columns.index(name)
+            records[name] = np.array([row[i] for row in rows], dtype=dtype)
+        records['profile'] = [self.profile_ids.setdefault(row[-1], len(self.profile_ids)) for row in rows]
+        self.batches.append(records)
+
+    def save(self, customer_file):
+        rows = np.concatenate(self.batches) if self.batches else np.empty(0, dtype=record_dtype)
+        encoded = [f'{s}\n'.encode() for name in text_columns for s in self.strings[name]]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        bases = np.cumsum([0] + [len(self.strings[name]) for name in text_columns]).tolist()
+        meta = {
+            'version': STORE_VERSION,
+            'bases': dict(zip(text_columns, bases)),
+            'profiles': sorted(self.profile_ids, key=self.profile_ids.get),
+            **file_signature(customer_file), # on disk, to detect a stale store
+        }
+        paths = store_paths(customer_file)
+        # the metadata last: a store without it is never loaded
+        if os.path.exists(paths['meta']):
+            os.remove(paths['meta'])
+        for key, values in (('rows', rows), ('strings', np.frombuffer(b''.join(encoded), dtype=np.uint8)), ('offsets', offsets)):
+            with atomic_write(paths[key], 'wb') as f:
+                np.save(f, values)
+        with atomic_write(paths['meta']) as f:
+            json.dump(meta, f)
+
+
+class CustomerStore:
+
+    def __init__(self, customer_file):
+        paths = store_paths(customer_file)
+        with open(paths['meta'], 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported customer store version {meta['version']} for {customer_file}")
+        self.customer_file = customer_file
+        self.bases = meta['bases']
+        self.profiles = meta['profiles']
+        self.signature = {key: meta.get(key) for key in signature_keys}
+        self.rows = np.load(paths['rows'], mmap_mode='r')
+        self.strings = np.load(paths['strings'], mmap_mode='r')
+        self.offsets = np.load(paths['offsets'], mmap_mode='r')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def profile_id(self, profile_name):
+        return self.profiles.index(profile_name) if profile_name in self.profiles else -1
+
+    def profile_rows(self, profile_name, start=0, end=None):
+        # row ids of the customers of a profile within rows start..end inclusive, one vectorized mask
+        end = len(self) - 1 if end is None else min(end, len(self) - 1)
+        ids = np.flatnonzero(self.rows['profile'][start:end + 1] == self.profile_id(profile_name))
+        return ids + start
+
+    def text(self, name, codes):
+        # strings of a column's codes. The strings of a column are in order of first appearance, so the codes of a
+        # row range fall in a narrow range of the table: it is read in one go, then split when the codes are dense
+        # (or sliced string by string when they are sparse, e.g. the customers of one profile)
+        if not len(codes):
+            return []
+        base = self.bases[name]
+        low, high = int(codes.min()), int(codes.max()) + 1
+        start, end = int(self.offsets[base + low]), int(self.offsets[base + high])
+        buf = self.strings[start:end].tobytes()
+        if high - low <= 2 * len(codes):
+            decoded = buf.decode().split('\n')
+            return [decoded[i] for i in (codes - low).tolist()]
+        starts = (self.offsets[base + codes] - start).tolist()
+        ends = (self.offsets[base + codes + 1] - start - 1).tolist()
+        return [buf[a:b].decode() for a, b in zip(starts, ends)]
+
+    def read_rows(self, start, end, profile_name=None):
+        # rows start..end (inclusive) as tuples of column strings, optionally only those of one profile.
+        # Same rows as CustomerIndex.read_rows, already split into columns.
+        end = min(end, len(self) - 1)
+        if start > end:
+            return []
+        if profile_name is None:
+            records = np.array(self.rows[start:end + 1])
+        else:
+            records = self.rows[self.profile_rows(profile_name, start, end)]
+        values = [self.text(name, records['text'][:, j]) for j, name in enumerate(text_columns)]
+        values.append([self.profiles[i] for i in records['profile'].tolist()])
+        return list(zip(*values))
+
+
+def build_customer_store(customer_file, batch_size=10000):
+    # one streaming pass over an existing customer file
+    builder = CustomerStoreBuilder()
+    with open_file(customer_file, 'rb') as f:
+        header = f.readline().decode().strip().split('|')
+        if header != columns:
+            raise ValueError(f'Unexpected columns in {customer_file}: {header}')
+        batch = []
+        for line in f:
+            batch.append(line.decode().strip().split('|'))
+            if len(batch) == batch_size:
+                builder.add_rows(batch)
+                batch = []
+        if batch:
+            builder.add_rows(batch)
+    builder.save(customer_file)
+
+
+def remove_customer_store(customer_file):
+    # when the customer file is rewritten without its store, so an old store can never be taken for it
+    for path in store_paths(customer_file).values():
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_customer_store(customer_file):
+    # the store of a customer file, or None when there is none or it does not match the file
+    if not os.path.exists(store_paths(customer_file)['meta']):
+        return None
+    store = CustomerStore(customer_file)
+    if store.signature != file_signature(customer_file):
+        return None
+    return store
@@ -6,24 +6,51 @@ import argparse
 import pathlib
 import os
 import json
+from datetime import datetime, timedelta
 from multiprocessing import Pool, cpu_count
 
 import datagen_customer
-from datagen_transaction import main as datagen_transactions
-from datagen_static_merchants import main as datagen_static_merchants
+from datagen_transaction import main as datagen_transactions, main_work_unit as datagen_transactions_work_unit, share_reference_tables, init_worker
+from datagen_static_merchants import main as datagen_static_merchants, cust_merchants_path as static_merchants_path, name_pool_size
 from utilities import valid_date
+from identity_pools import IdentityPools, default_pool_dir
+from customer_index import load_customer_index
+from customer_store import load_customer_store, build_customer_store
+from sinks import compressors, compressed_path
+from manifests import parse_shard, shard_tasks, task_files, write_manifest, file_entry, task_done
+from manifests import RUN_MANIFEST_VERSION, run_manifest_name, load_run_manifest, write_run_manifest, reference_entry, reference_changed
+from merge_transactions import merge_transactions
+from scheduler import profile_costs, plan, split_tail, run_numbered_task
+import instrumentation
+import profile_weights
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Sparkov Card Fraud Dataset Generator')
     parser.add_argument('-n', '--nb_customers', type=int, help='Number of customers to generate', default=10)
-    parser.add_argument('start_date', type=valid_date, help='Transactions start date')
-    parser.add_argument('end_date', type=valid_date, help='Transactions start date')
+    parser.add_argument('start_date', type=valid_date, nargs='?', help='Transactions start date (with --resume/--extend-to, taken from the run manifest if omitted)', default=None)
+    parser.add_argument('end_date', type=valid_date, nargs='?', help='Transactions end date (with --resume/--extend-to, taken from the run manifest if omitted)', default=None)
     parser.add_argument('-seed', type=int, nargs='?', help='Random generator seed', default=42)
     parser.add_argument('-config', type=pathlib.Path, nargs='?', help='Profile config file (typically profiles/main_config.json")', default='./profiles/main_config.json')
     parser.add_argument('-c', '--customer_file', type=pathlib.Path, help='Customer file generated with the datagen_customer script', default=None)
     parser.add_argument('-o', '--output', type=pathlib.Path, help='Output Folder path', default='data')
     parser.add_argument('-s', '--static_merchants', action='store_true', help='Whether generate merchants with static coordinates and identify high-risk merchants') # Static merchants switch
     parser.add_argument('-i', '--scenario_identifier', action='store_true', help='Mark scenario-generated transactions with scenario markers') # If need seperate markers for transactions generated under different scenarios
+    parser.add_argument('-b', '--batch_size', type=int, help='Generate customers in vectorized batches of this size', default=None)
+    parser.add_argument('--merchant_batch', action='store_true', help=f'With -s, generate the static merchants vectorized per city, spread over the workers. Without -p their names come from a pool of {name_pool_size} Faker company names, so they repeat in large merchant tables')
+    parser.add_argument('-w', '--work_units', action='store_true', help='Generate the transactions of all profiles in one pass per customer range, instead of one task per profile and range')
+    parser.add_argument('--split_profiles', action='store_true', help='In work unit mode, still write one output file per profile and range')
+    parser.add_argument('-f', '--format', choices=['csv', 'columnar'], help='Output format: pipe-delimited text or columnar binary chunks (columnar.py)', default='csv')
+    parser.add_argument('-z', '--compression', choices=sorted(compressors), help='Compress the transaction files while writing them (customers and merchants stay plain text)', default=None)
+    parser.add_argument('-p', '--pools', type=pathlib.Path, nargs='?', const=default_pool_dir, help='Draw customer and merchant identities from cached Faker pools in this folder', default=None)
+    parser.add_argument('--shard', type=parse_shard, help='Only run shard i of N (i/N) of the tasks and write its manifest, see manifests.py', default=None)
+    parser.add_argument('--merge', action='store_true', help='Also merge the csv output into one transactions_sorted.csv file ordered by unix_time, see merge_transactions.py')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: number of CPUs)', default=None)
+    parser.add_argument('--profile-report', dest='profile_report', type=pathlib.Path, help='Time the generation stages of every task and write the aggregated JSON report (and a .txt summary) to this file', default=None)
+    parser.add_argument('--profile_cache', type=pathlib.Path, help="Folder of the compiled profile date weights, reused across runs ('none' to disable)", default=profile_weights.default_cache_dir)
+    parser.add_argument('--customer_store', action='store_true', help='Write (or build from the customer file) the binary customer store the transaction workers read instead of the text file, see customer_store.py')
+    parser.add_argument('--chunk_size', type=int, help='Fixed number of customers per task, instead of tasks sized from their estimated cost', default=None)
+    parser.add_argument('--resume', action='store_true', help='Continue the run recorded in the run manifest of the output folder, skipping its completed tasks')
+    parser.add_argument('--extend-to', dest='extend_to', type=valid_date, help='Add the transactions from the end of the recorded run up to this date, for the same customers (resumes the run first)', default=None)
     
     args = parser.parse_args()
     num_cust = args.nb_customers
@@ -36,11 +63,60 @@ if __name__ == '__main__':
     customers_out_file = customer_file or os.path.join('customers_merchants/customers.csv')
     is_static = bool(args.static_merchants)
     need_identifier = bool(args.scenario_identifier)
+    batch_size = args.batch_size
+    pool_dir = args.pools
+    work_units = bool(args.work_units)
+    split_profiles = bool(args.split_profiles)
+    output_format = args.format
+    out_ext = '.cols' if output_format == 'columnar' else '.csv'
+    compression = args.compression
+    shard = args.shard
+    if args.merge and output_format != 'csv':
+        parser.error('--merge only applies to the csv format')
+
+    # run manifest: the plan of the run and its completed tasks, checkpointed as the tasks finish
+    manifest_path = os.path.join(out_path, run_manifest_name(shard))
+    run_params = {
+        'seed': seed_num, 'config': str(config), 'chunk_size': args.chunk_size, 'static_merchants': is_static,
+        'scenario_identifier': need_identifier, 'work_units': work_units, 'split_profiles': split_profiles,
+        'format': output_format, 'compression': compression, 'shard': list(shard) if shard else None,
+    }
+    previous = None
+    if args.resume or args.extend_to:
+        try:
+            previous = load_run_manifest(manifest_path)
+        except ValueError as e:
+            parser.error(str(e))
+        if previous is None:
+            parser.error(f'no run manifest to resume in {out_path}')
+        changed = sorted(key for key in run_params if previous['run'].get(key) != run_params[key])
+        if changed:
+            parser.error(f"the recorded run was generated with different {', '.join(changed)}")
+        first_window = previous['windows'][0]
+        recorded = (datetime.fromisoformat(first_window['start_date']), datetime.fromisoformat(first_window['end_date']))
+        if start_date is None and end_date is None:
+            start_date, end_date = recorded
+        elif (start_date, end_date) != recorded:
+            parser.error(f"the run manifest was written for {first_window['start_date']} - {first_window['end_date']}")
+        # the customers of the recorded run, never regenerated
+        customer_file = customers_out_file = previous['reference']['customers']['path']
+        if reference_changed(previous['reference']['customers']):
+            parser.error(f'{customers_out_file} is missing or changed since the recorded run')
+    elif start_date is None or end_date is None:
+        parser.error('start_date and end_date are required')
+    # set before the pool is created, inherited by the workers
+    profile_weights.cache_dir = None if str(args.profile_cache).lower() == 'none' else str(args.profile_cache)
 
     # create the folder if it does not exist
     if not os.path.exists(out_path):
         os.makedirs(out_path)
 
+    reports = []
+    if args.profile_report:
+        # the parent's own stages (customers, static merchants) are reported as one more task
+        instrumentation.enable()
+        started = instrumentation.start_task()
+
     # if no customers file provided, generate a customers file
     if customer_file is None and num_cust is not None:
         if os.path.exists(customers_out_file):
@@ -48,32 +124,40 @@ if __name__ == '__main__':
             agree = input(f"File {customers_out_file} already exists. Overwrite? (y/N)")
             if agree.lower() != 'y':
                 exit(1)
-        datagen_customer.main(num_cust, seed_num, config, customers_out_file)
+        datagen_customer.main(num_cust, seed_num, config, customers_out_file, batch_size, pool_dir, store=args.customer_store)
         
     elif customer_file is None:
         print('Either a customer file or a number of customers to create must be provided')
         exit(1)
     
-    # if we're supplied with a customer file, we need to figure how many we have
+    # if we're supplied with a customer file, we need to figure how many we have.
+    # The sidecar index is (re)built here once when needed, so workers never have to scan the file.
+    customer_index = load_customer_index(customers_out_file)
     if customer_file is not None:
-        num_cust = 0
-        with open(customer_file, 'r') as f:
-            for row in f.readlines():
-                num_cust += 1
+        num_cust = len(customer_index)
+        if args.customer_store and load_customer_store(customers_out_file) is None:
+            try:
+                build_customer_store(customers_out_file)
+            except ValueError as e:
+                parser.error(str(e))
 
-    if is_static: # If is_static is True, generate merchants with static coordinates and also the fraud transactions will be based on different scenario
-        datagen_static_merchants(num_cust, datagen_customer.activated_cities_pos)
+    if is_static and previous is not None:
+        # the completed tasks used the recorded static merchants, they must not change
+        recorded = previous['reference']['merchants_static']
+        if reference_changed(recorded):
+            parser.error(f"{recorded['path']} is missing or changed since the recorded run")
+    elif is_static: # If is_static is True, generate merchants with static coordinates and also the fraud transactions will be based on different scenario
+        pools = IdentityPools(num_cust, seed=seed_num, path=pool_dir) if pool_dir is not None else None
+        with instrumentation.stage('merchants.static'):
+            activated = datagen_customer.activated_cities
+            if customer_file is not None:
+                # customers not generated by this run: their cities are counted from the customer file
+                activated = datagen_customer.ActivatedCities.from_customer_file(customers_out_file)
+            # in batch mode (--merchant_batch) the merchants are vectorized per city and the cities spread over the workers
+            datagen_static_merchants(num_cust, activated, pools, seed=seed_num, batch=args.merchant_batch, workers=args.workers)
 
-    # figure out reasonable chunk size
-    num_cpu = cpu_count()
-    print(f"Num CPUs: {num_cpu}")
-    chunk_size = max(min(int(num_cust / 5), 1000), 1000 * int(num_cust / (1000 * num_cpu)))
-    # because from one profile to another, there may be a 10-50x difference in size, it is best to use small
-    # chunk sizes so as to spread the work across all CPUs. Bigger chunks means a core may process small profiles 
-    # quickly and then be idle, while other cores process large profiles. Smaller chunks will run faster
-    
-    # zero padding determination
-    zero_pad = len(str(num_cust - 1))
+    if args.profile_report:
+        reports.append(instrumentation.end_task('customers and merchants', started))
 
     # read config
     with open(config, 'r') as f:
@@ -81,31 +165,139 @@ if __name__ == '__main__':
 
     profile_names = configs.keys()
 
+    num_cpu = cpu_count()
+    print(f"Num CPUs: {num_cpu}")
+    plan_workers = (args.workers or num_cpu) if shard is None else 8 * shard[1]
+
+    if previous is None:
+        # signatures of the files the tasks are generated from, a resumed run must find them unchanged
+        reference = {'customers': reference_entry(customers_out_file)}
+        if is_static:
+            reference['merchants_static'] = reference_entry(static_merchants_path)
+        manifest = {'version': RUN_MANIFEST_VERSION, 'run': run_params, 'reference': reference, 'windows': [], 'completed': {}}
+        windows = [(start_date, end_date)]
+    else:
+        manifest = previous
+        windows = [(datetime.fromisoformat(w['start_date']), datetime.fromisoformat(w['end_date'])) for w in manifest['windows']]
+        if args.extend_to and args.extend_to > windows[-1][1]:
+            # the new window starts the day after the recorded end date
+            windows.append((windows[-1][1] + timedelta(days=1), args.extend_to))
+            if (windows[-1][1] - windows[-1][0]).days < 8:
+                parser.error('--extend-to must add at least 9 days, the fraud windows are drawn a week before the end date')
+        elif args.extend_to and args.extend_to not in [end for _, end in windows]:
+            parser.error(f"--extend-to must be after {windows[-1][1].date().isoformat()}, the end date of the recorded run")
+
+    # zero padding determination
+    zero_pad = len(str(num_cust - 1))
+
     args_array = []
-    for profile_file in configs.keys():
-        customer_file_offset_start = 0
-        customer_file_offset_end = min(num_cust - 1, chunk_size - 1)
-        while customer_file_offset_start <= max(num_cust - 1, chunk_size):
-            print(f"profile: {profile_file}, chunk size: {chunk_size}, \
-                chunk: {customer_file_offset_start}-{customer_file_offset_end}")
-            transactions_filename = os.path.join(out_path, 
-                profile_file.replace('.json', 
-                    f'_{str(customer_file_offset_start).zfill(zero_pad)}-{str(customer_file_offset_end).zfill(zero_pad)}.csv'))
-            # Arguments need to be passed as a tuple
-            args_array.append((
-                customers_out_file, 
-                pathlib.Path(os.path.join('profiles', profile_file)), 
-                start_date, 
-                end_date, 
-                transactions_filename,
-                customer_file_offset_start,
-                customer_file_offset_end,
-                is_static,
-                need_identifier
-            ))
-            customer_file_offset_start += chunk_size
-            customer_file_offset_end = min(num_cust - 1, customer_file_offset_end + chunk_size)
-
-    with Pool() as p:
-        p.starmap(datagen_transactions, args_array)
-        
\ No newline at end of file
+    task_windows = [] # date window of every task
+    for w, (window_start, window_end) in enumerate(windows):
+        if w < len(manifest['windows']):
+            # planned when the window was first run: a resumed run must cut the same tasks
+            planned = [tuple(task) for task in manifest['windows'][w]['tasks']]
+        else:
+            # Cost-based planning: from one profile to another, there may be a 10-50x difference in cost per customer.
+            # The cost of every customer is estimated from its profile, the customer ranges are cut into tasks of about
+            # the same cost (a small profile gets a single task), and the tasks are dispatched largest first.
+            # Shards must cut the same tasks whatever the machine they run on, so they plan for 8 workers per shard.
+            costs = profile_costs('profiles', profile_names, (window_end - window_start).days, is_static)
+            planned = plan(customer_index, costs, plan_workers, work_units, args.chunk_size)
+            if not args.chunk_size:
+                # the last tasks to go out are split, so the run does not end on a single straggler
+                planned = split_tail(planned, customer_index, costs, plan_workers, work_units)
+            manifest['windows'].append({
+                'start_date': window_start.date().isoformat(), 'end_date': window_end.date().isoformat(),
+                'plan_workers': plan_workers, 'tasks': [list(task) for task in planned],
+            })
+        # extension windows: their own file names, and their own random streams (the seed mixed with the window start)
+        window_tag = '' if w == 0 else f"_{window_start.strftime('%Y%m%d')}-{window_end.strftime('%Y%m%d')}"
+        window_seed = seed_num if w == 0 or seed_num is None else [seed_num, window_start.toordinal()]
+
+        for profile_file, customer_file_offset_start, customer_file_offset_end, cost in planned:
+            chunk_name = f'{str(customer_file_offset_start).zfill(zero_pad)}-{str(customer_file_offset_end).zfill(zero_pad)}{window_tag}{out_ext}'
+            print(f"{profile_file or 'work unit'}, chunk: {customer_file_offset_start}-{customer_file_offset_end}{window_tag}, estimated cost: {cost:.0f}")
+            task_windows.append((window_start, window_end))
+            if work_units:
+                # one task per customer range, generating the transactions of all profiles in a single pass
+                transactions_filename = os.path.join(out_path, f'{{profile}}_{chunk_name}' if split_profiles else f'transactions_{chunk_name}')
+                args_array.append((datagen_transactions_work_unit, (
+                    customers_out_file,
+                    pathlib.Path('profiles'),
+                    list(profile_names),
+                    window_start,
+                    window_end,
+                    transactions_filename,
+                    customer_file_offset_start,
+                    customer_file_offset_end,
+                    is_static,
+                    need_identifier,
+                    split_profiles,
+                    output_format,
+                    compression,
+                    window_seed,
+                    bool(args.profile_report)
+                )))
+            else:
+                transactions_filename = os.path.join(out_path, profile_file.replace('.json', f'_{chunk_name}'))
+                # Arguments need to be passed as a tuple
+                args_array.append((datagen_transactions, (
+                    customers_out_file, 
+                    pathlib.Path(os.path.join('profiles', profile_file)), 
+                    window_start, 
+                    window_end, 
+                    transactions_filename,
+                    customer_file_offset_start,
+                    customer_file_offset_end,
+                    is_static,
+                    need_identifier,
+                    output_format,
+                    compression,
+                    window_seed,
+                    bool(args.profile_report)
+                )))
+
+    # output path (or {profile} pattern) of each task, with the extension added by the compression
+    out_index = 5 if work_units else 4
+    task_outputs = [compressed_path(task[1][out_index], compression) if output_format == 'csv' else task[1][out_index] for task in args_array]
+
+    # a shard runs every N-th task of the full list; the per-customer seeds make its output the same as a single-node run
+    tasks = shard_tasks(args_array, shard or (0, 1))
+    pending = [(task_id, task) for task_id, task in tasks if not task_done(manifest, task_id, out_path)]
+    if len(pending) < len(tasks):
+        print(f"resuming: {len(tasks) - len(pending)} of {len(tasks)} tasks already completed")
+    write_run_manifest(manifest_path, manifest)
+
+    task_reports = []
+    if pending:
+        # merchants and compiled profiles are loaded once here and shared with the workers, instead of once per task
+        date_ranges = sorted({task_windows[task_id] for task_id, _ in pending})
+        with share_reference_tables(is_static, [pathlib.Path('profiles', name) for name in profile_names], date_ranges) as shared, \
+                Pool(args.workers, initializer=init_worker, initargs=(shared.spec, is_static)) as p:
+            # largest first, each task handed to the next worker that frees up; checkpointed as soon as it is done
+            for task_id, report in p.imap_unordered(run_numbered_task, pending):
+                manifest['completed'][str(task_id)] = [file_entry(path, out_path, task_id) for path in task_files(task_outputs[task_id])]
+                write_run_manifest(manifest_path, manifest)
+                task_reports.append(report)
+
+    if args.profile_report:
+        # per-worker task reports aggregated here
+        reports.extend(task_reports)
+        print(instrumentation.write_report(args.profile_report, reports))
+
+    shard_outputs = [(task_id, task_outputs[task_id]) for task_id, _ in tasks]
+
+    if shard is not None:
+        run = {
+            'seed': seed_num, 'start_date': start_date.date().isoformat(), 'end_date': end_date.date().isoformat(),
+            'windows': [[w['start_date'], w['end_date']] for w in manifest['windows']],
+            'nb_customers': num_cust, 'config': str(config), 'chunk_size': args.chunk_size, 'plan_workers': plan_workers, 'static_merchants': is_static,
+            'scenario_identifier': need_identifier, 'work_units': work_units, 'split_profiles': split_profiles,
+            'format': output_format, 'compression': compression,
+        }
+        print(f"manifest: {write_manifest(out_path, shard, run, len(args_array), shard_outputs)}")
+
+    if args.merge:
+        chunks = [path for _, out_pattern in shard_outputs for path in task_files(out_pattern)]
+        rows = merge_transactions(chunks, os.path.join(out_path, 'transactions_sorted.csv'), workers=args.workers, compression=compression)
+        print(f"merged {len(chunks)} chunks, {rows} rows")
@@ -1,12 +1,18 @@
 from faker import Faker
-import sys, math
 from datetime import date
 import random
+import numpy as np
 from main_config import MainConfig
 import argparse
 import pathlib
 from bisect import bisect_left
-from utilities import randomize_coordinate
+from utilities import randomize_coordinate, randomize_coordinates
+from identity_pools import IdentityPools, default_pool_dir
+from customer_index import CustomerIndexBuilder
+from customer_store import CustomerStoreBuilder, remove_customer_store
+from cdf_sampler import CDFSampler
+from sinks import TextSink, compressors, open_file
+from instrumentation import stage, count
 
 
 headers = [
@@ -28,7 +34,55 @@ headers = [
     'profile'
 ]
 
-activated_cities_pos = [] # If a city in locations_partitions.csv has at least one customer, its coordinates will be stored in this list
+
+class ActivatedCities:
+    # streaming aggregate of the cities customers live in (the cities of locations_partitions.csv with at least
+    # one customer): zip -> [city row, customer count], in order of first customer. O(#cities) memory.
+
+    def __init__(self):
+        self.cities = {}
+        self.customers = 0
+        self.pop_sum = 0 # population of the city of every customer, summed over the customers
+
+    def add(self, city, n=1):
+        entry = self.cities.get(city[2])
+        if entry is None:
+            entry = self.cities[city[2]] = [city, 0]
+        entry[1] += n
+        self.customers += n
+        self.pop_sum += int(city[5]) * n
+
+    def add_rows(self, city_rows):
+        for city in city_rows:
+            self.add(city)
+
+    def items(self):
+        # (city row [city, state, zip, lat, long, population], customer count)
+        return [(city, n) for city, n in self.cities.values()]
+
+    def __len__(self):
+        return len(self.cities)
+
+    @classmethod
+    def from_customer_file(cls, path):
+        # rebuilt in one pass over a customer file: its coordinates are randomized, so the city rows are
+        # looked up by zip in locations_partitions.csv
+        load_tables()
+        by_zip = {city[2]: city for city in cities.values()}
+        zip_col = headers.index('zip')
+        activated = cls()
+        with open_file(path) as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    zip_code = line.split('|', zip_col + 1)[zip_col]
+                    if zip_code not in by_zip:
+                        raise ValueError(f'Zip {zip_code} of customer file {path} is not in locations_partitions.csv')
+                    activated.add(by_zip[zip_code])
+        return activated
+
+
+activated_cities = ActivatedCities() # cities of the customers generated by main, for the static merchants
 
 def make_cities():
     cities = {}
@@ -39,6 +93,22 @@ def make_cities():
         return cities
 
 
+# demographic tables, read on first use (load_tables) so that importing the module, e.g. for its headers, is free
+cities = None
+age_gender = None
+city_sampler = None
+age_gender_sampler = None
+
+
+def load_tables():
+    global cities, age_gender, city_sampler, age_gender_sampler
+    if cities is None:
+        cities = make_cities()
+        age_gender = make_age_gender_dict()
+        city_sampler = CDFSampler.from_cumsum(cities)
+        age_gender_sampler = CDFSampler.from_cumsum(age_gender)
+
+
 def make_age_gender_dict():
     gender_age = {}
     prev = 0
@@ -53,35 +123,45 @@ def make_age_gender_dict():
 class Customer:
     # Randomly generates all the attributes for a customer
 
-    def __init__(self, config, seed_num=None):
+    def __init__(self, config, seed_num=None, pools=None):
+        load_tables()
+        # Faker and random states of this generator only, so several generators can run side by side
         self.fake = Faker()
         if seed_num is not None:
-            Faker.seed(seed_num)
-        # turn all profiles into dicts to work with
-        self.all_profiles = MainConfig(config).config
+            self.fake.seed_instance(seed_num)
+        self.random = random.Random(seed_num) # locations and coordinates of the row by row path
+        # turn all profiles into dicts to work with, compiled into a lookup table (overlaps and gaps logged once here)
+        self.main_config = MainConfig(config)
+        self.main_config.write_warnings()
+        self.all_profiles = self.main_config.config
+        self.rng = np.random.default_rng(seed_num)
+        self.pools = pools # optional IdentityPools replacing the Faker calls in batch mode
 
 
     def generate_customer(self):
-        self.gender, self.dob, self.age = self.generate_age_gender()
-        self.addy = self.get_random_location()
-
-        city_pos = self.addy # Save the generated city coordinates (not randomized) for later use
-
-        self.addy[3], self.addy[4] = randomize_coordinate(self.addy[3], self.addy[4], 0.5) # 'Shake' the customers' coordinates
-
-        customer_data = [
-            self.fake.ssn(),
-            self.fake.credit_card_number(),
-            self.get_first_name(),
-            self.fake.last_name(),
-            self.gender,
-            self.fake.street_address()
-        ] + self.addy + [
-            self.fake.job(),
-            self.dob,
-            str(self.fake.random_number(digits=12)),
-            self.find_profile()
-        ]
+        with stage('customers.sampling'):
+            self.gender, self.dob, self.age = self.generate_age_gender()
+            self.addy = self.get_random_location()
+
+            city_pos = self.addy # Save the generated city coordinates (not randomized) for later use
+
+            self.addy[3], self.addy[4] = randomize_coordinate(self.addy[3], self.addy[4], 0.5, self.random) # 'Shake' the customers' coordinates
+
+        with stage('customers.faker'):
+            customer_data = [
+                self.fake.ssn(),
+                self.fake.credit_card_number(),
+                self.get_first_name(),
+                self.fake.last_name(),
+                self.gender,
+                self.fake.street_address()
+            ] + self.addy + [
+                self.fake.job(),
+                self.dob,
+                str(self.fake.random_number(digits=12)),
+                self.find_profile()
+            ]
+        count('customers.rows')
 
         return customer_data, city_pos # Also return the city information with the customer living in
 
@@ -92,7 +172,7 @@ class Customer:
             return self.fake.first_name_female()
 
     def generate_age_gender(self):
-        n = random.random()
+        n = self.random.random()
         g_a = age_gender[min([a for a in age_gender if a > n])]
 
         while True:
@@ -114,7 +194,7 @@ class Customer:
         """
         Assumes lst is sorted. Returns closest value to num.
         """
-        num = random.random()
+        num = self.random.random()
         lst = list(cities.keys())
         pos = bisect_left(lst, num)
         if pos == 0:
@@ -129,58 +209,156 @@ class Customer:
             return cities[before]
 
     def find_profile(self):
-        city_pop = float(self.addy[-1])
-
-        match = []
-        for pro in self.all_profiles:
-            # -1 represents infinity
-            if (self.gender in self.all_profiles[pro]['gender']
-                and self.age >= self.all_profiles[pro]['age'][0]
-                and (self.age < self.all_profiles[pro]['age'][1] 
-                    or self.all_profiles[pro]['age'][1] == -1) 
-                and city_pop >= self.all_profiles[pro]['city_pop'][0] 
-                and (city_pop < self.all_profiles[pro]['city_pop'][1] 
-                    or self.all_profiles[pro]['city_pop'][1] == -1)
-                ):
-                match.append(pro)
-        if match == []:
-            match.append('leftovers.json')
-
-        # found overlap -- write to log file but continue
-        if len(match) > 1:
-            with open('profile_overlap_warnings.log', 'a') as f:
-                f.write(f"{' '.join(match)}: {self.gender} {str(self.age)} {str(city_pop)}\n")
-        return match[0]
-
-
-def main(num_cust, seed_num, config, out_path):
+        return self.match_profile(self.gender, self.age, float(self.addy[-1]))
+
+    def match_profile(self, gender, age, city_pop):
+        # first profile of the config matching the customer, leftovers.json if none (see MainConfig.compile)
+        return self.main_config.match(gender, age, city_pop)
+
+    def generate_age_gender_batch(self, n):
+        # vectorized generate_age_gender: inverse CDF over age_gender, then a random month/day for the dob
+        g_a = age_gender_sampler.sample(n, self.rng)
+        genders = [g[0][0] for g in g_a]
+        ages = np.array([int(g[1]) for g in g_a])
+
+        today = date.today()
+        months, mdays = self.random_month_days(n)
+        birth_years = today.year - ages - (today.month * 100 + today.day < months * 100 + mdays)
+        # Feb 29 does not exist in non-leap birth years: redraw those, as the scalar version retries
+        while True:
+            bad = (months == 2) & (mdays == 29) & ~((birth_years % 4 == 0) & ((birth_years % 100 != 0) | (birth_years % 400 == 0)))
+            if not bad.any():
+                break
+            months[bad], mdays[bad] = self.random_month_days(bad.sum())
+            birth_years[bad] = today.year - ages[bad] - (today.month * 100 + today.day < months[bad] * 100 + mdays[bad])
+
+        dobs = [f"{y:04d}-{m:02d}-{d:02d}" for y, m, d in zip(birth_years.tolist(), months.tolist(), mdays.tolist())]
+        return genders, dobs, ages
+
+    def random_month_days(self, n):
+        # pick days of the (leap) year 2000, so Feb 29 can come up like it does with date_time_this_century()
+        days = np.datetime64('2000-01-01') + self.rng.integers(0, 366, n)
+        months = days.astype('datetime64[M]')
+        return months.astype(int) % 12 + 1, (days - months).astype(int) + 1
+
+    def generate_customers_batch(self, n):
+        # Generate n customers at once: age/gender, city, dob and coordinate jitter are drawn as numpy arrays,
+        # only the Faker attributes are still produced row by row
+        with stage('customers.sampling'):
+            genders, dobs, ages = self.generate_age_gender_batch(n)
+            city_rows = city_sampler.sample(n, self.rng)
+
+            lats = np.array([float(c[3]) for c in city_rows])
+            longs = np.array([float(c[4]) for c in city_rows])
+            lats, longs = randomize_coordinates(lats, longs, 0.5, self.rng) # 'Shake' the customers' coordinates
+        count('customers.rows', n)
+
+        if self.pools is not None:
+            with stage('customers.pools'):
+                return self.pooled_customers(n, genders, dobs, ages, city_rows, lats, longs), city_rows
+
+        with stage('customers.sampling'):
+            profiles = self.main_config.assign(genders, ages, [float(c[5]) for c in city_rows])
+
+        with stage('customers.faker'):
+            customers = []
+            for i, (city, lat, long) in enumerate(zip(city_rows, lats.tolist(), longs.tolist())):
+                gender = genders[i]
+                first = self.fake.first_name_male() if gender == 'M' else self.fake.first_name_female()
+                customers.append([
+                    self.fake.ssn(),
+                    self.fake.credit_card_number(),
+                    first,
+                    self.fake.last_name(),
+                    gender,
+                    self.fake.street_address(),
+                    city[0], city[1], city[2], str(lat), str(long), city[5],
+                    self.fake.job(),
+                    dobs[i],
+                    str(self.fake.random_number(digits=12)),
+                    profiles[i]
+                ])
+        return customers, city_rows # Also return the (not randomized) cities the customers live in
+
+    def pooled_customers(self, n, genders, dobs, ages, city_rows, lats, longs):
+        # same columns as generate_customers_batch, with identities drawn from the pools by index
+        unique = self.pools.take_unique(n)
+        is_male = np.array(genders) == 'M'
+        firsts = np.where(is_male, self.pools.sample('first_male', n, self.rng), self.pools.sample('first_female', n, self.rng))
+        columns = zip(
+            unique['ssn'].tolist(), unique['cc_num'].tolist(), firsts.tolist(),
+            self.pools.sample('last', n, self.rng).tolist(), genders,
+            self.pools.sample('street', n, self.rng).tolist(), city_rows, lats.tolist(), longs.tolist(),
+            self.pools.sample('job', n, self.rng).tolist(), dobs, unique['acct_num'].tolist(),
+            self.main_config.assign(genders, ages, [float(c[5]) for c in city_rows]))
+        return [
+            [ssn, cc_num, first, last, gender, street, city[0], city[1], city[2], str(lat), str(long), city[5],
+             job, dob, acct_num, profile]
+            for ssn, cc_num, first, last, gender, street, city, lat, long, job, dob, acct_num, profile in columns
+        ]
+
+
+def main(num_cust, seed_num, config, out_path, batch_size=None, pool_dir=None, compression=None, store=False):
     if num_cust <= 0 or seed_num is None or config is None:
         parser.print_help()
         exit(1)
 
-    # setup output to file by redirecting stdout (Should be put into utilities later)
-    original_sys_stdout = sys.stdout
-    if out_path is not None:
-        f_out = open(out_path, 'w')
-        sys.stdout = f_out
+    # buffered output (stdout when no path is given), optionally compressed
+    sink = TextSink(out_path, compression)
+    # record the byte offset and profile of every row for the sidecar index
+    index = CustomerIndexBuilder(len(("|".join(headers) + "\n").encode())) if out_path is not None else None
+    # and optionally the binary customer store read by the transaction workers (see customer_store.py)
+    store = CustomerStoreBuilder() if store and out_path is not None else None
 
     # print headers
-    print("|".join(headers))
-
-    c = Customer(config=config, seed_num=seed_num)
+    sink.write_row(headers)
+
+    pools = None
+    if pool_dir is not None:
+        # identities come from the cached pools, which only batch mode can draw from
+        pools = IdentityPools(num_cust, seed=seed_num, path=pool_dir)
+        batch_size = batch_size or 10000
+
+    c = Customer(config=config, seed_num=seed_num, pools=pools)
+
+    if batch_size:
+        # batch mode: generate and write batch_size customers at a time
+        for batch_start in range(0, num_cust, batch_size):
+            customers, city_rows = c.generate_customers_batch(min(batch_size, num_cust - batch_start))
+            activated_cities.add_rows(city_rows)
+            lines = ["|".join(cust) + "\n" for cust in customers]
+            if index is not None:
+                for line, cust in zip(lines, customers):
+                    index.add(line.encode(), cust[-1])
+            if store is not None:
+                store.add_rows(customers)
+            sink.writelines(lines)
+        num_cust = 0
+
+    pending = [] # row by row customers not yet added to the store
 
     for _ in range(num_cust):
         customer_data_pos = c.generate_customer() # Generate attributes for individual customers
-        activated_cities_pos.append(customer_data_pos[1]) # Store the returned city coordinates into the list
-        print("|".join(customer_data_pos[0]))
-
-    # restore original sdtout when done
-    if out_path is not None:
-        sys.stdout = original_sys_stdout
-
-
-cities = make_cities()
-age_gender = make_age_gender_dict()
+        activated_cities.add(customer_data_pos[1]) # Count the customer in its (not randomized) city
+        line = "|".join(customer_data_pos[0]) + "\n"
+        if index is not None:
+            index.add(line.encode(), customer_data_pos[0][-1])
+        if store is not None:
+            pending.append(customer_data_pos[0])
+            if len(pending) == 10000:
+                store.add_rows(pending)
+                pending = []
+        sink.write(line)
+
+    sink.close()
+    if index is not None:
+        index.save(sink.path)
+    if store is not None:
+        if pending:
+            store.add_rows(pending)
+        store.save(sink.path)
+    elif sink.path is not None:
+        remove_customer_store(sink.path)
 
 
 if __name__ == '__main__':
@@ -189,6 +367,10 @@ if __name__ == '__main__':
     parser.add_argument('seed', type=int, nargs='?', help='Random generator seed', default=42)
     parser.add_argument('config', type=pathlib.Path, nargs='?', help='Profile config file (typically profiles/main_config.json")', default='./profiles/main_config.json')
     parser.add_argument('-o', '--output', type=pathlib.Path, help='Output file path', default=None)
+    parser.add_argument('-b', '--batch_size', type=int, help='Generate customers in vectorized batches of this size', default=None)
+    parser.add_argument('-p', '--pools', type=pathlib.Path, nargs='?', const=default_pool_dir, help='Draw identities from cached Faker pools (built on first use) in this folder', default=None)
+    parser.add_argument('-z', '--compression', choices=sorted(compressors), help='Compress the output file while writing it', default=None)
+    parser.add_argument('--store', action='store_true', help='Also write the binary customer store (customer_store.py) read by the transaction workers')
 
     args = parser.parse_args()
     num_cust = args.count
@@ -196,5 +378,5 @@ if __name__ == '__main__':
     config = args.config
     out_path = args.output
 
-    main(num_cust, seed_num, config, out_path)
+    main(num_cust, seed_num, config, out_path, args.batch_size, args.pools, args.compression, args.store)
     
\ No newline at end of file
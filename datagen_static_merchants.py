@@ -1,11 +1,15 @@
 ### Generates merchants with fixed coordinates and piped into customers_merchants/merchants_static.csv
+### Batch mode (generate_merchants_batch) draws the risk flags, coordinates and names of a whole city as NumPy
+### arrays, with one random stream per city, and spreads the cities over worker processes.
 
 from faker import Factory
 from math import ceil
-import sys, random
-from utilities import randomize_coordinate
+from multiprocessing import Pool
+import random
+import numpy as np
+from utilities import randomize_coordinate, randomize_coordinates
+from sinks import TextSink
 
-fake = Factory.create('en_US')
 cust_merchants_path = "./customers_merchants/merchants_static.csv"
 
 header = "category|merchant_name|lat|long|fraud_risk"
@@ -31,8 +35,24 @@ moderate_risk_cates = ["misc_net","misc_pos","shopping_net","food_dining"]
 online_shopping = ["grocery_net","misc_net","shopping_net","utilities"]
 brick_and_mortar = ["gas_transport","food_dining"]
 
+name_pool_size = 10000 # batch mode without identity pools: company names drawn from this many Faker names (use -p for more)
+cities_per_task = 500
+company_names = None # name pool of the batch mode workers, see set_company_names
 
-def main(n_customers, addy_list):
+
+def new_fake(seed=None):
+    # a Faker instance with its own random state, so concurrent generators do not share one
+    fake = Factory.create('en_US')
+    if seed is not None:
+        fake.seed_instance(seed)
+    return fake
+
+
+def generate_merchants(n_customers, activated, pools=None, seed=None):
+    # yields the merchant rows [category, merchant_name, lat, long, fraud_risk] of the activated cities
+    # (datagen_customer.ActivatedCities)
+    fake = new_fake(seed)
+    rand = random.Random(seed)
 
     if n_customers <= 1000:
         coef = 5 # For each customer, generate roughly 5 merchants if customers are less than 1000.
@@ -44,22 +64,12 @@ def main(n_customers, addy_list):
     total_number = n_customers * coef # Total number of the merchants
     
     freq_n_coordinates = {}
-    pop_sum = 0
+    # The total population in this round of simulation (population of the city of every customer)
+    pop_sum = activated.pop_sum
 
-    for city in addy_list:
+    for city, _ in activated.items():
         # Save the cdf of each city in a dictionary, with [population, lat, long] as value
         freq_n_coordinates[city[2]] = [int(city[5]),(float(city[3]),float(city[4]))]
-        # Calculate the total population in this round of simulation (population sum for all the activated cities)
-        pop_sum += int(city[5])
-
-
-    # setup output to file by redirecting stdout
-    original_sys_stdout = sys.stdout
-    if cust_merchants_path is not None:
-        f_out = open(cust_merchants_path, 'w')
-        sys.stdout = f_out
-
-    print(header)
 
     for city in freq_n_coordinates:
         freq_n_coordinates[city][0] = freq_n_coordinates[city][0]/pop_sum # Now the value is: [population divided by total_population, lat, long]
@@ -71,16 +81,85 @@ def main(n_customers, addy_list):
             merchant_number = category_merchant_number
             if c in brick_and_mortar:
                 merchant_number = 3 * category_merchant_number
-            for _ in range(merchant_number):
-                merchant_fraud_flag = random.randint(1,100) 
+            # with identity pools, draw all the names of this city and category at once instead of calling Faker
+            names = pools.sample('company', merchant_number).tolist() if pools is not None else None
+            for i in range(merchant_number):
+                merchant_fraud_flag = rand.randint(1,100) 
                 # If hit: 1% chance; 5% percent chance and the category is of moderate risk; 10% percent chance and the category is of high risk, then this merchant is compromised.
                 if merchant_fraud_flag == 1 or (merchant_fraud_flag <= 5 and c in moderate_risk_cates) or (merchant_fraud_flag <= 10 and c in high_risk_cates):
                     fraud_risk = 1
                 else:
                     fraud_risk = 0
-                print(f"{c}|{fake.company()}|{'|'.join(randomize_coordinate(*freq_n_coordinates[city][1],0.5))}|{fraud_risk}")
-    
-    # restore original sdtout when done
-    if cust_merchants_path is not None:
-        sys.stdout = original_sys_stdout
+                merchant_name = names[i] if names is not None else fake.company()
+                yield [c, merchant_name, *randomize_coordinate(*freq_n_coordinates[city][1], 0.5, rand), str(fraud_risk)]
+
+
+def merchant_counts(n_customers, activated):
+    # (city row, merchants per category of category_list) of the activated cities, rounded like generate_merchants
+    total_number = n_customers * (5 if n_customers <= 1000 else 1)
+    per_category = np.array([3 if c in brick_and_mortar else 1 for c in category_list])
+    counts = []
+    for city, _ in activated.items():
+        city_merchant_number = ceil(total_number * (int(city[5]) / activated.pop_sum))
+        category_merchant_number = ceil(city_merchant_number/(len(category_list)+ 2 * len(brick_and_mortar)))
+        counts.append((city, per_category * category_merchant_number))
+    return counts
+
+
+def set_company_names(names):
+    global company_names
+    company_names = names
+
+
+def city_merchants(city, counts, seed):
+    # merchant lines of one city, drawn from its own random stream (keyed by seed and zip), so the output
+    # does not depend on how the cities are spread over the workers
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(city[2]),)))
+    n = int(counts.sum())
+    cates = np.repeat(np.arange(len(category_list)), counts)
+    # 1% chance to be compromised; 5% for the categories of moderate risk, 10% for those of high risk
+    flags = rng.integers(1, 101, n)
+    limits = np.array([10 if c in high_risk_cates else 5 if c in moderate_risk_cates else 1 for c in category_list])
+    fraud_risk = (flags <= limits[cates]).astype(int)
+    lats, longs = randomize_coordinates(np.full(n, float(city[3])), np.full(n, float(city[4])), 0.5, rng)
+    names = company_names[rng.integers(0, len(company_names), n)]
+    return [f"{category_list[c]}|{name}|{lat}|{long}|{risk}\n" for c, name, lat, long, risk in
+            zip(cates.tolist(), names.tolist(), lats.tolist(), longs.tolist(), fraud_risk.tolist())]
+
+
+def merchant_block(task):
+    # merchant lines of a group of cities, as one string
+    cities, seed = task
+    return "".join(line for city, counts in cities for line in city_merchants(city, counts, seed))
+
+
+def generate_merchants_batch(n_customers, activated, pools=None, seed=None, workers=1):
+    # yields the text of the merchants of the activated cities, cities_per_task cities at a time, in city order.
+    # Names come from the identity pools, or from a pool of name_pool_size Faker names
+    counts = merchant_counts(n_customers, activated)
+    if pools is not None:
+        names = np.asarray(pools.get('company'))
+    else:
+        fake = new_fake(seed)
+        names = np.array([fake.company() for _ in range(min(name_pool_size, max(1, sum(int(c.sum()) for _, c in counts))))])
+    tasks = [(counts[i:i + cities_per_task], seed) for i in range(0, len(counts), cities_per_task)]
+    if workers == 1:
+        set_company_names(names)
+        yield from map(merchant_block, tasks)
+        return
+    with Pool(workers, initializer=set_company_names, initargs=(names,)) as p:
+        yield from p.imap(merchant_block, tasks)
+
+
+def main(n_customers, activated, pools=None, compression=None, seed=None, batch=False, workers=None):
+    # buffered output, optionally compressed
+    sink = TextSink(cust_merchants_path, compression)
+    sink.write(header + "\n")
+    if batch:
+        for block in generate_merchants_batch(n_customers, activated, pools, seed, workers):
+            sink.write(block)
+    else:
+        for row in generate_merchants(n_customers, activated, pools, seed):
+            sink.write_row(row)
+    sink.close()
         
\ No newline at end of file
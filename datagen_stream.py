@@ -0,0 +1,107 @@
+### In-process streaming API: generates customers and transactions as Python batches instead of files,
+### for feeding a DataFrame, a queue or a test fixture directly.
+### Nothing is written to disk and no module-global state is touched (merchants, profiles and the Faker and random
+### states are held by the generator; only the read-only reference tables are loaded once per process),
+### so several streams can run side by side in one process.
+###
+###   from datagen_stream import stream_transactions
+###   for batch in stream_transactions(1000, date(2023, 1, 1), date(2023, 12, 31), batch_size=50000):
+###       ...
+
+import json
+import pathlib
+
+import numpy as np
+
+import datagen_customer
+import datagen_static_merchants
+import datagen_transaction
+from identity_pools import IdentityPools
+
+customer_headers = datagen_customer.headers
+transaction_headers = datagen_customer.headers + datagen_transaction.transaction_headers
+
+
+def as_records(rows, names):
+    # a NumPy record array of a batch of row tuples
+    return np.rec.fromrecords(rows, names=names)
+
+
+def customer_batches(nb_customers, seed=42, config='./profiles/main_config.json', batch_size=10000, pool_dir=None):
+    # yields (customers, city_rows) batches, the same customers as datagen_customer.main in batch mode
+    pools = IdentityPools(nb_customers, seed=seed, path=pool_dir) if pool_dir is not None else None
+    generator = datagen_customer.Customer(config=config, seed_num=seed, pools=pools)
+    for batch_start in range(0, nb_customers, batch_size):
+        yield generator.generate_customers_batch(min(batch_size, nb_customers - batch_start))
+
+
+def stream_customers(nb_customers, seed=42, config='./profiles/main_config.json', batch_size=10000, pool_dir=None, records=False):
+    # yields batches of at most batch_size customers, as lists of tuples (columns: customer_headers)
+    # or record arrays
+    for customers, _ in customer_batches(nb_customers, seed, config, batch_size, pool_dir):
+        rows = [tuple(cust) for cust in customers]
+        yield as_records(rows, customer_headers) if records else rows
+
+
+def static_merchant_table(nb_customers, seed, config, batch_size, pool_dir):
+    # static merchants depend on the cities of all the customers: a first pass over the (deterministic)
+    # customer stream only counts the customers per city, so memory grows with the cities, not the customers
+    activated = datagen_customer.ActivatedCities()
+    for _, city_rows in customer_batches(nb_customers, seed, config, batch_size, pool_dir):
+        activated.add_rows(city_rows)
+    pools = IdentityPools(nb_customers, seed=seed, path=pool_dir) if pool_dir is not None else None
+    rows = datagen_static_merchants.generate_merchants(nb_customers, activated, pools, seed)
+    return datagen_transaction.merchants_from_rows(rows, static=True)
+
+
+class TransactionBatcher:
+    # writer collecting the transactions handed to Customer.print_trans as row tuples
+
+    def __init__(self):
+        self.rows = []
+
+    def write_transactions(self, cust, cols):
+        prefix = tuple(cust.raw)
+        dates = np.datetime_as_string(cols['trans_date'], unit='D').tolist()
+        self.rows.extend(
+            prefix + (tn, d, f"{h:02d}:{m:02d}:{sec:02d}", u, cat, round(amt, 2), fr, mer, float(la), float(lo), onl)
+            for tn, d, h, m, sec, u, cat, amt, fr, mer, la, lo, onl in zip(
+                cols['trans_num'].tolist(), dates, cols['hour'].tolist(), cols['minute'].tolist(), cols['second'].tolist(),
+                cols['unix_time'].tolist(), cols['category'].tolist(), cols['amt'].tolist(), cols['is_fraud'].tolist(),
+                cols['merchant'].tolist(), cols['merch_lat'].tolist(), cols['merch_long'].tolist(), cols['is_online'].tolist()))
+
+    def take(self, n):
+        rows, self.rows = self.rows[:n], self.rows[n:]
+        return rows
+
+
+def stream_transactions(nb_customers, start_date, end_date, seed=42, config='./profiles/main_config.json', profile_dir='profiles',
+                        is_static=False, need_identifier=False, batch_size=10000, pool_dir=None, records=False):
+    # yields batches of at most batch_size transactions (columns: transaction_headers, customer columns first),
+    # as lists of tuples or record arrays.
+    # Customers are generated batch_size at a time and only one customer's transactions are pending on top
+    # of the current batch, so memory stays bounded by the batch size rather than the number of customers.
+    with open(config, 'r') as f:
+        profile_names = set(json.load(f))
+
+    if is_static:
+        merchant_table, grids = static_merchant_table(nb_customers, seed, config, batch_size, pool_dir)
+    else:
+        merchant_table, grids = datagen_transaction.load_merchants(False)
+
+    profiles = {} # compiled profiles of this stream only
+    batcher = TransactionBatcher()
+    for customers, _ in customer_batches(nb_customers, seed, config, batch_size, pool_dir):
+        for cust_row in customers:
+            cust = datagen_transaction.Customer("|".join(cust_row), merchant_table, grids)
+            profile_name = cust.attrs['profile']
+            if profile_name not in profile_names:
+                continue
+            profile, fraud_profile = datagen_transaction.load_profiles(pathlib.Path(profile_dir, profile_name), start_date, end_date, profiles, use_cache=False)
+            datagen_transaction.generate_customer_transactions(cust, profile, fraud_profile, start_date, end_date, is_static, need_identifier, batcher, seed)
+            while len(batcher.rows) >= batch_size:
+                rows = batcher.take(batch_size)
+                yield as_records(rows, transaction_headers) if records else rows
+    if batcher.rows:
+        rows = batcher.take(len(batcher.rows))
+        yield as_records(rows, transaction_headers) if records else rows
@@ -1,20 +1,28 @@
 import argparse
 import csv
+import hashlib
 import json
 import pathlib
-import random
 import sys
+import zlib
 from datetime import timedelta
 
-from faker import Faker
 import numpy as np
 
 from datagen_customer import headers
 from datagen_static_merchants import high_risk_cates, moderate_risk_cates, online_shopping, brick_and_mortar
 from profile_weights import Profile
 from utilities import valid_date
+from customer_index import load_customer_index
+from customer_store import load_customer_store
+from columnar import ColumnarWriter
+from spatial_index import GridIndex
+from shared_tables import SharedArrays, attach
+import profile_weights
+from sinks import TextSink, compressors, open_file, existing_path
+import instrumentation
+from instrumentation import stage, count
 
-fake = Faker()
 transaction_headers = [
     'trans_num', 
     'trans_date', 
@@ -29,37 +37,115 @@ transaction_headers = [
     'is_online'
 ]
 
-merchants = {} # A global variable to store returned merchants from read_merchants()
+# storage kind of every output column in the columnar format (see columnar.py)
+transaction_schema = [
+    ('ssn', 'text'), ('cc_num', 'text'), ('first', 'dict'), ('last', 'dict'), ('gender', 'dict'), ('street', 'text'),
+    ('city', 'dict'), ('state', 'dict'), ('zip', 'dict'), ('lat', 'float'), ('long', 'float'), ('city_pop', 'int'),
+    ('job', 'dict'), ('dob', 'date'), ('acct_num', 'text'), ('profile', 'dict'),
+    ('trans_num', 'text'), ('trans_date', 'date'), ('trans_time', 'int32'), ('unix_time', 'int'), ('category', 'dict'),
+    ('amt', 'float'), ('is_fraud', 'dict'), ('merchant', 'dict'), ('merch_lat', 'float'), ('merch_long', 'float'),
+    ('is_online', 'int8')
+]
 
-def read_merchants(static = False):
-    # read file to merchant variable only once / built a map of merchant per category for easy lookup
+merchants = {} # A global variable to store returned merchants from read_merchants()
+merchant_grids = {} # Per category spatial index over the static merchants' coordinates, aligned with merchants[category]
+shared_merchants = None # static flag of the merchant tables installed by init_worker, main() then does not read them again
+
+def merchants_from_rows(rows, static = False):
+    # build a map of merchant per category (and the spatial index of static merchants) from merchant rows.
+    # Per category: an array of names, or for static merchants a structured array of (name, lat, long, fraud_risk)
+    # (coordinates kept as the file's text, fraud_risk as an int8)
+    columns = {}
+    for row in rows:
+        columns.setdefault(row[0], []).append(row[1:5] if static else row[1])
+    table = {}
+    grids = {}
+    for cate, values in columns.items():
+        if static:
+            fields = [np.array(field) for field in zip(*values)]
+            fields[3] = fields[3].astype(np.int8)
+            table[cate] = np.empty(len(values), dtype=[(name, f.dtype) for name, f in zip(['name', 'lat', 'long', 'fraud_risk'], fields)])
+            for name, f in zip(table[cate].dtype.names, fields):
+                table[cate][name] = f
+            # built once per table, radius queries then only look at the grid cells around the customer
+            grids[cate] = GridIndex(table[cate]['lat'].astype(float), table[cate]['long'].astype(float))
+        else:
+            table[cate] = np.array(values)
+    return table, grids
+
+def load_merchants(static = False):
+    # read the merchants file into a new (table, grids) pair
     if static:
         merchants_path = 'customers_merchants/merchants_static.csv'
     else:
         merchants_path = 'customers_merchants/merchants.csv'
-    with open(merchants_path, 'r') as merchants_file:
+    # plain or compressed, see datagen_static_merchants.main
+    with open_file(existing_path(merchants_path)) as merchants_file:
         csv_reader = csv.reader(merchants_file, delimiter='|')
         # skip header
         csv_reader.__next__()
-        for row in csv_reader:
-            if merchants.get(row[0]) is None:
-                merchants[row[0]] = []
-            if static:
-                merchants[row[0]].append([row[1],row[2],row[3],row[4]])
-            else:
-                merchants[row[0]].append(row[1])
+        return merchants_from_rows(csv_reader, static)
 
-def get_list_terminals_within_radius(cust_lat, cust_long, merchant_list, r): 
+def read_merchants(static = False):
+    # read file to merchant variable only once / built a map of merchant per category for easy lookup.
+    # Rebuilt from scratch, so repeated calls in a worker do not append the same merchants again
+    global shared_merchants
+    table, grids = load_merchants(static)
+    shared_merchants = None
+    merchants.clear()
+    merchants.update(table)
+    merchant_grids.clear()
+    merchant_grids.update(grids)
+
+def share_reference_tables(is_static, profile_files, date_ranges):
+    # parent side of init_worker: the merchant tables with their spatial index, and the compiled date weights
+    # of the profiles (and their fraud profiles) over the (start, end) date ranges of the run, packed once into shared memory
+    table, grids = load_merchants(is_static)
+    arrays = {f'merchants/{cate}': values for cate, values in table.items()}
+    for cate, grid in grids.items():
+        arrays.update({f'grid/{cate}/{name}': values for name, values in grid.arrays().items()})
+    for profile_file in profile_files:
+        for path in [profile_file, pathlib.Path(*list(profile_file.parts)[:-1] + [f"fraud_{profile_file.name}"])]:
+            with open(path, 'r') as f:
+                profile = Profile(json.load(f))
+            for start_date, end_date in date_ranges:
+                days, weights = profile.load_compiled(start_date, end_date)
+                key = "/".join([profile.hash, str(days[0]), str(days[-1])])
+                arrays[f'profile/{key}/days'], arrays[f'profile/{key}/weights'] = days, weights
+    return SharedArrays(arrays)
+
+def init_worker(spec, is_static):
+    # Pool initializer: installs the shared tables of share_reference_tables in this worker, without copying them
+    global shared_merchants
+    arrays = attach(spec)
+    table, grid_arrays = {}, {}
+    for key, values in arrays.items():
+        kind, name, field = (key.split('/') + [None])[:3]
+        if kind == 'merchants':
+            table[name] = values
+        elif kind == 'grid':
+            grid_arrays.setdefault(name, {})[field] = values
+        elif kind == 'profile' and key.endswith('/days'):
+            profile_hash, start, end = key.split('/')[1:4]
+            profile_weights.compiled_ranges[(profile_hash, start, end)] = (values, arrays[key[:-len('days')] + 'weights'])
+    merchants.clear()
+    merchants.update(table)
+    merchant_grids.clear()
+    merchant_grids.update({cate: GridIndex.from_arrays(grid) for cate, grid in grid_arrays.items()})
+    shared_merchants = is_static
+
+def get_list_terminals_within_radius(cust_lat, cust_long, merchant_list, r, grid = None): 
+
+    if grid is not None:
+        # indexed lookup (see read_merchants), same result as the full scan below
+        return merchant_list[grid.query(cust_lat, cust_long, r)]
 
         # Inspired by: https://fraud-detection-handbook.github.io/fraud-detection-handbook/Chapter_3_GettingStarted/SimulatedDataset.html
         # Use numpy arrays in the following to speed up computations
         # Location (x,y) of customer as numpy array
     customer_lat_long = np.array([float(cust_lat), float(cust_long)])
 
-    merch_coordinates = []
-    for merch in merchant_list:
-        merch_coordinates.append([float(merch[1]), float(merch[2])])
-    merch_coordinates =  np.array(merch_coordinates)
+    merch_coordinates = np.stack([merchant_list['lat'].astype(float), merchant_list['long'].astype(float)], axis=1)
 
     # Squared difference in coordinates between customer and terminal locations
     squared_diff = np.square(customer_lat_long - merch_coordinates)
@@ -70,19 +156,47 @@ def get_list_terminals_within_radius(cust_lat, cust_long, merchant_list, r):
     # Get the indices of terminals which are at a distance less than r
     available_idx = list(np.where(dist<r)[0])
 
-    # Get a list of available merchants
-    available_merchants = [merchant_list[idx] for idx in available_idx]
+    # Get the available merchants
+    available_merchants = merchant_list[available_idx]
 
     return available_merchants
 
 class Customer:
-    def __init__(self, raw):
-        self.raw = raw.strip().split('|') # Customer attributes
-        self.attrs = self.parse_customer(raw)
+    def __init__(self, raw, merchant_table = None, grids = None):
+        # raw: a line of the customer file, or its columns already split (rows of the customer store)
+        self.raw = raw.strip().split('|') if isinstance(raw, str) else raw # Customer attributes
+        # merchants to pick from, the tables loaded by read_merchants() unless given
+        self.merchants = merchants if merchant_table is None else merchant_table
+        self.merchant_grids = merchant_grids if grids is None else grids
+        self.attrs = dict(zip(headers, self.raw)) # name: value for each column
         self.fraud_dates = []
-
-    def print_trans(self, trans, is_fraud, fraud_dates, static = False, scenario_identifier = False):
-
+        self.nearby_merchants = {} # (category, radius) -> indices into merchants[category], see merchants_within()
+
+    def merchants_within(self, cate, r):
+        # Static merchants of a category within 0.1 and 0.5 degree of home, computed once per category:
+        # the customer never moves, so every later transaction reuses them.
+        if (cate, r) not in self.nearby_merchants:
+            with stage('transactions.radius_search'):
+                grid = self.merchant_grids[cate]
+                lat, long = float(self.attrs['lat']), float(self.attrs['long'])
+                within_far = grid.query(lat, long, 0.5)
+                dist = np.sqrt(np.square(grid.lat[within_far] - lat) + np.square(grid.long[within_far] - long))
+                self.nearby_merchants[(cate, 0.5)] = within_far
+                self.nearby_merchants[(cate, 0.1)] = within_far[dist < 0.1]
+                if (cate, r) not in self.nearby_merchants:
+                    self.nearby_merchants[(cate, r)] = grid.query(lat, long, r)
+        return self.nearby_merchants[(cate, r)]
+
+    def release(self):
+        # evict the cached merchant candidates once all the customer's transactions are generated
+        self.nearby_merchants.clear()
+
+    def build_trans(self, trans, is_fraud, fraud_dates, static = False, scenario_identifier = False, rng = None):
+        # pick merchants for a batch of sampled transactions, returning the columns of the rows to output
+        if rng is None:
+            rng = np.random.default_rng()
+
+        cols = dict(trans[0]) # Columns of the batch sampled by Profile.sample_from
         is_traveling = trans[1] # Always NO in the current version. TODO in the future.
         travel_max = trans[2]
 
@@ -93,34 +207,41 @@ class Customer:
             # sorry for being American, you're on your own for kilometers.
             rad = (float(travel_max) / 100) * 1.43
 
-        for t in trans[0]: 
-            # Each t is a list: [trans#, date, time, transaction number, category, amount, is_fraud]
-            cate = t[4]
-            merchants_in_category = merchants.get(cate) 
-
-            cust_lat = self.attrs['lat']
-            cust_long = self.attrs['long']
-
-            is_online = 0
-        
-            if static:
-                # All the print() which commented out can be uncommented for debugging. Remember to change sys.stdout accordingly.
+        n = len(cols['unix_time'])
+        cust_lat = self.attrs['lat']
+        cust_long = self.attrs['long']
+        fraud_flags = cols['is_fraud']
+        keep = np.ones(n, dtype=bool)
+
+        if static:
+            # the merchant of each row is picked by its index in merchants[category], the columns are gathered after the loop
+            picks = {} # category -> ([row], [merchant index])
+            is_onlines = [0] * n
+            for i, cate in enumerate(cols['category'].tolist()):
+                merchants_in_category = self.merchants.get(cate) 
+                picked = picks.get(cate)
+                if picked is None:
+                    picked = picks[cate] = ([], [], merchants_in_category['fraud_risk'])
+                risk = picked[2]
+                is_online = 0
+                # All the print() which commented out can be uncommented for debugging, they go to the console (rows go through the writer).
                 if cate in online_shopping: 
                     #print(f"Online shopping for {self.raw}, cate: {cate}.") # Such helper prints can be added whenever needed. 
                     is_online = 1
                 else:
-                    available_merchants = get_list_terminals_within_radius(cust_lat, cust_long, merchants_in_category, 0.1) # Default radius: 0.1 degree
-                    if available_merchants: select_merchant_instance = random.sample(available_merchants, 1)[0]
+                    available_idx = self.merchants_within(cate, 0.1) # Default radius: 0.1 degree
+                    if len(available_idx): pick = rng.choice(available_idx)
                     else:
-                        im_driving = random.randint(1,100)
+                        im_driving = rng.integers(1, 101)
                         if (im_driving <= 30 or cate in brick_and_mortar):  # If rolled under 30 or the category is brick_and_mortar, search at a higher radius (e.g., 0.5 degree).
                             #print(f" No available merchant in the city. If driving: {im_driving}; Category: {cate};  Customer: {self.raw}")
-                            available_merchants = get_list_terminals_within_radius(cust_lat, cust_long, merchants_in_category, 0.5)
-                            if available_merchants: 
+                            available_idx = self.merchants_within(cate, 0.5)
+                            if len(available_idx): 
                                 #print(f"Found some merchants after driving!")
-                                select_merchant_instance = random.sample(available_merchants, 1)[0]
+                                pick = rng.choice(available_idx)
                             elif cate in brick_and_mortar:
                                 #print(f"No brick-n-mortar store in {cate} is available for this customer. Won't shop at this time")
+                                keep[i] = False
                                 continue
                             else:
                                 #print(f"Drove for an extra 0.4 degree and no chance. Deided to go shopping online.")
@@ -128,11 +249,12 @@ class Customer:
                         else:
                             is_online = 1
                 if is_online:
-                    select_merchant_instance = random.sample(merchants_in_category, 1)[0] # If the category is in online_shopping, do not bother finding the merchants near customer
+                    pick = rng.integers(len(merchants_in_category)) # If the category is in online_shopping, do not bother finding the merchants near customer
 
                 # If the merchant is compromised or the transaction happend online and the customer is of 50+ age:
-                if select_merchant_instance[3] == '1' or (is_online and ('50up' in self.raw[-1])): 
-                    merchant_fraud_flag = random.randint(1,100)
+                if risk.item(pick) == 1 or (is_online and ('50up' in self.raw[-1])): 
+                    merchant_fraud_flag = rng.integers(1, 101)
+                    count('transactions.scenario_rolls')
 
                     # A variable to save the conditions to trigger three different scenarios. Specifically:
                     # "High risk merchants" and no olled under 10;
@@ -142,107 +264,223 @@ class Customer:
                         else 'group:vulnerable' if (('50up' in self.raw[-1] and is_online) and merchant_fraud_flag <= 5) else None
 
                     if  scenario_flag: # If the scenario_flag is not None
+                        count('transactions.scenario_frauds')
                         #print(f"Encountered risky merchant! Cate: {cate}, Risk: {risk(cate)}, If 50+:{'50up' in self.raw[-1]}, Rolled {merchant_fraud_flag}.")
-                        is_fraud = 1
                         if scenario_identifier:
-                            t[6] = scenario_flag # Directly use the scenario_flag as the transaction identifier
+                            fraud_flags[i] = scenario_flag # Directly use the scenario_flag as the transaction identifier
                         else:
-                            t[6] = 1 # Simply save ordinary flag int 1 to mark fraud transactions
+                            fraud_flags[i] = '1' # Simply save ordinary flag 1 to mark fraud transactions
                         #print('Fraud due to transaction at risky merchant/online.')
 
-                chosen_merchant, merch_lat,  merch_long = select_merchant_instance[0], select_merchant_instance[1], select_merchant_instance[2]
+                picked[0].append(i)
+                picked[1].append(pick)
+                is_onlines[i] = is_online
+
+            chosen_merchants = np.empty(n, dtype=object)
+            merch_lats = np.empty(n, dtype=object)
+            merch_longs = np.empty(n, dtype=object)
+            for cate, (rows, idx, _) in picks.items():
+                chosen = self.merchants[cate][np.array(idx, dtype=np.int64)]
+                chosen_merchants[rows], merch_lats[rows], merch_longs[rows] = chosen['name'], chosen['lat'], chosen['long']
+        else:
+            # merchants drawn per category, coordinates uniformly within rad of home (as fake.coordinate did, to 6 decimals)
+            chosen_merchants = np.empty(n, dtype=object)
+            for cate in np.unique(cols['category']).tolist():
+                in_cate = cols['category'] == cate
+                merchants_in_category = self.merchants.get(cate)
+                chosen_merchants[in_cate] = [merchants_in_category[j] for j in rng.integers(0, len(merchants_in_category), in_cate.sum()).tolist()]
+            merch_lats = [f"{x:.6f}" for x in (float(cust_lat) + rng.uniform(-rad, rad, n)).tolist()]
+            merch_longs = [f"{x:.6f}" for x in (float(cust_long) + rng.uniform(-rad, rad, n)).tolist()]
+            is_onlines = [0] * n
+
+        # legit transactions falling on a fraud date are dropped, fraud ones are always kept
+        keep &= (fraud_flags != '0') | ~np.isin(cols['trans_date'], np.asarray(fraud_dates, dtype='datetime64[D]'))
+
+        cols['is_fraud'] = fraud_flags
+        cols['merchant'] = np.array(chosen_merchants, dtype=object)
+        cols['merch_lat'] = np.array(merch_lats, dtype=object)
+        cols['merch_long'] = np.array(merch_longs, dtype=object)
+        cols['is_online'] = np.array(is_onlines)
+        return {k: v[keep] for k, v in cols.items()}
+
+    def format_trans(self, cols):
+        # the only place the columns are turned into text rows
+        prefix = "|".join(self.raw) + "|"
+        dates = np.datetime_as_string(cols['trans_date'], unit='D').tolist()
+        return [
+            f"{prefix}{tn}|{d}|{h:02d}:{m:02d}:{sec:02d}|{u}|{cat}|{amt:.2f}|{fr}|{mer}|{la}|{lo}|{onl}\n"
+            for tn, d, h, m, sec, u, cat, amt, fr, mer, la, lo, onl in zip(
+                cols['trans_num'].tolist(), dates, cols['hour'].tolist(), cols['minute'].tolist(), cols['second'].tolist(),
+                cols['unix_time'].tolist(), cols['category'].tolist(), cols['amt'].tolist(), cols['is_fraud'].tolist(),
+                cols['merchant'].tolist(), cols['merch_lat'].tolist(), cols['merch_long'].tolist(), cols['is_online'].tolist())
+        ]
+
+    def print_trans(self, trans, is_fraud, fraud_dates, static = False, scenario_identifier = False, writer = None, rng = None):
+        # writer: a sinks.TextSink or a ColumnarTransactions; without one, rows go to stdout
+        with stage('transactions.static_merchants' if static else 'transactions.merchants'):
+            cols = self.build_trans(trans, is_fraud, fraud_dates, static, scenario_identifier, rng)
+        count('transactions.rows', len(cols['unix_time']))
+        with stage('transactions.write'):
+            if writer is not None:
+                writer.write_transactions(self, cols)
             else:
-                chosen_merchant = random.sample(merchants_in_category, 1)[0]
-                merch_lat = fake.coordinate(center=float(cust_lat),radius=rad) 
-                merch_long = fake.coordinate(center=float(cust_long),radius=rad)
-
-            if (is_fraud == 0 and t[1] not in fraud_dates) or is_fraud == 1: 
-                features = self.raw + t + [chosen_merchant, str(merch_lat), str(merch_long), str(is_online)]
-                print("|".join(features)) # Final output print
-
-
-    def parse_customer(self, line):
-        # separate into a list of attrs
-        cols = [c for c in line.strip().split('|')]
-        # create a dict of name: value for each column
-        return dict(zip(headers, cols))
-
-def main(customer_file, profile_file, start_date, end_date, out_path=None, start_offset=0, end_offset=sys.maxsize, is_static = False, need_identifier = False):
+                sys.stdout.write("".join(self.format_trans(cols))) # Final output print
+
+profiles_cache = {} # compiled (profile, fraud_profile) pairs, kept warm across the tasks of a worker process
+
+def load_profiles(profile_file, start_date, end_date, cache = profiles_cache, use_cache = True):
+    # use_cache=False compiles the date weights without the memo and disk cache of profile_weights
+    key = (str(profile_file), start_date, end_date)
+    if key not in cache:
+        profile_file_fraud = pathlib.Path(*list(profile_file.parts)[:-1] + [f"fraud_{profile_file.name}"]) 
+        with open(profile_file, 'r') as f:
+            profile_obj = json.load(f)
+        with open(profile_file_fraud, 'r') as f:
+            profile_fraud_obj = json.load(f)
+
+        with stage('profile.compile'):
+            profile = Profile({**profile_obj}, use_cache) 
+            profile.set_date_range(start_date, end_date)
+            fraud_profile = Profile({**profile_fraud_obj}, use_cache)
+            # compiled over the whole range once, the fraud windows of the customers are then slices of it
+            fraud_profile.set_date_range(start_date, end_date)
+        cache[key] = (profile, fraud_profile)
+    return cache[key]
+
+def customer_rngs(seed, cust):
+    # (legit, fraud) random streams of a customer, keyed by (seed, customer, profile, fraud/legit) with SeedSequence:
+    # the output of a customer does not depend on which worker, chunk or shard generates it, or in which order.
+    # seed=None draws fresh entropy (unreproducible run)
+    identity = "|".join([cust.attrs['ssn'], cust.attrs['cc_num'], cust.attrs['acct_num']])
+    customer_key = int.from_bytes(hashlib.blake2b(identity.encode(), digest_size=8).digest(), 'little')
+    profile_key = zlib.crc32(cust.attrs['profile'].encode())
+    return [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(customer_key, profile_key, stream))) for stream in (0, 1)]
+
+def generate_customer_transactions(cust, profile, fraud_profile, start_date, end_date, is_static = False, need_identifier = False, writer = None, seed = None):
+    legit_rng, fraud_rng = customer_rngs(seed, cust)
+    inter_val = (end_date - start_date).days - 7
+    is_fraud = 0
+    fraud_flag = fraud_rng.integers(1, 101) # set fraud flag here, as we either gen real or fraud, not both for the same day. 
+    fraud_dates = []
+    # decide if we generate fraud or not
+    if fraud_flag <= 10: #11->25 Original percentage: 99%, which implies almost everybody will encounter fraud at least for once
+        fraud_interval = int(fraud_rng.integers(1, 2))
+        # rand_interval is the random no of days to be added to start date
+        rand_interval = int(fraud_rng.integers(1, inter_val + 1))
+        #random start date is selected
+        newstart = start_date + timedelta(days=rand_interval)   
+        # based on the fraud interval , random enddate is selected
+        newend = newstart + timedelta(days=fraud_interval)
+        # we assume that the fraud window can be between 1 to 7 days 
+        fraud_profile.set_date_range(newstart, newend)
+        is_fraud = 1
+        count('transactions.fraud_customers')
+        with stage('profile.sample_from'):
+            temp_tx_data = fraud_profile.sample_from(is_fraud, fraud_rng) # Sample with weights in the fraud*.json files
+        fraud_dates = temp_tx_data[3] 
+        cust.print_trans(temp_tx_data, is_fraud, fraud_dates, static = is_static, scenario_identifier = need_identifier, writer = writer, rng = fraud_rng) 
+
+    # we're done with fraud (or didn't do it) but still need regular transactions
+    # we pass through our previously selected fraud dates (if any) to filter them
+    # out of regular transactions
+
+    is_fraud = 0
+    with stage('profile.sample_from'):
+        temp_tx_data = profile.sample_from(is_fraud, legit_rng)
+    cust.print_trans(temp_tx_data, is_fraud, fraud_dates, static = is_static, scenario_identifier = need_identifier, writer = writer, rng = legit_rng)
+    cust.release()
+
+class ColumnarTransactions(ColumnarWriter):
+    # columnar output of customer + transaction columns, see columnar.py for the reader side
+
+    def __init__(self, path):
+        super().__init__(path, transaction_schema)
+
+    def write_transactions(self, cust, cols):
+        columns = {**cust.attrs, **cols} # customer attributes are repeated on every row
+        columns['trans_time'] = cols['hour'] * 3600 + cols['minute'] * 60 + cols['second']
+        self.write(columns, len(cols['unix_time']))
+
+def open_output(out_path, output_format = 'csv', compression = None):
+    # buffered (optionally compressed) text sink, or columnar writer; both are passed down to print_trans
+    if output_format == 'columnar':
+        return ColumnarTransactions(out_path)
+    sink = TextSink(out_path, compression)
+    sink.write_row(headers + transaction_headers)
+    return sink
+
+def read_customers(customer_file, start_offset, end_offset, profile_name = None):
+    store = load_customer_store(customer_file)
+    if store is not None:
+        return store.read_rows(start_offset, end_offset, profile_name)
+    return load_customer_index(customer_file).read_rows(start_offset, end_offset, profile_name)
+
+def main(customer_file, profile_file, start_date, end_date, out_path=None, start_offset=0, end_offset=sys.maxsize, is_static = False, need_identifier = False, output_format = 'csv', compression = None, seed = None, profile_report = False):
 
     profile_name = profile_file.name
-    profile_file_fraud = pathlib.Path(*list(profile_file.parts)[:-1] + [f"fraud_{profile_name}"]) 
-
-    read_merchants(is_static)
+    if profile_report:
+        # timers, counters and tracemalloc peak of this task, returned to the parent
+        instrumentation.enable()
+        started = instrumentation.start_task()
 
-    # setup output to file by redirecting stdout
-    original_sys_stdout = sys.stdout
-    if out_path is not None:
-        f_out = open(out_path, 'w')
-        sys.stdout = f_out
+    if shared_merchants != is_static: # not already installed by init_worker
+        with stage('io.read_merchants'):
+            read_merchants(is_static)
 
-    with open(profile_file, 'r') as f:
-        profile_obj = json.load(f)
-    with open(profile_file_fraud, 'r') as f:
-        profile_fraud_obj = json.load(f)
+    writer = open_output(out_path, output_format, compression)
+    profile, fraud_profile = load_profiles(profile_file, start_date, end_date)
 
-    profile = Profile({**profile_obj}) 
-    profile.set_date_range(start_date, end_date)
-    fraud_profile = Profile({**profile_fraud_obj})
-
-    inter_val = (end_date - start_date).days - 7
     # for each customer, if the customer fits this profile
     # generate appropriate number of transactions
 
-    with open(customer_file, 'r') as f:
-        f.readline()
-        print("|".join(headers + transaction_headers))
-        line_num = 0
-        fail = False
-        # skip lines out of range
-        while line_num < start_offset:
-            try:
-                f.readline()
-                line_num += 1
-            except EOFError:
-                # end of file?
-                fail = True
-                break
-        if not fail:
-            for row in f.readlines():
-                cust = Customer(row)
-                if cust.attrs['profile'] == profile_name:
-                    is_fraud = 0
-                    fraud_flag = random.randint(1,100) # set fraud flag here, as we either gen real or fraud, not both for the same day. 
-                    fraud_dates = []
-                    # decide if we generate fraud or not
-                    if fraud_flag <= 10: #11->25 Original percentage: 99%, which implies almost everybody will encounter fraud at least for once
-                        fraud_interval = random.randint(1,1) 
-                        # rand_interval is the random no of days to be added to start date
-                        rand_interval = random.randint(1, inter_val)
-                        #random start date is selected
-                        newstart = start_date + timedelta(days=rand_interval)   
-                        # based on the fraud interval , random enddate is selected
-                        newend = newstart + timedelta(days=fraud_interval)
-                        # we assume that the fraud window can be between 1 to 7 days 
-                        fraud_profile.set_date_range(newstart, newend)
-                        is_fraud = 1
-                        temp_tx_data = fraud_profile.sample_from(is_fraud) # Sample with weights in the fraud*.json files
-                        fraud_dates = temp_tx_data[3] 
-                        cust.print_trans(temp_tx_data, is_fraud, fraud_dates, static = is_static, scenario_identifier = need_identifier) 
-
-                    # we're done with fraud (or didn't do it) but still need regular transactions
-                    # we pass through our previously selected fraud dates (if any) to filter them
-                    # out of regular transactions
-                    
-                    is_fraud = 0
-                    temp_tx_data = profile.sample_from(is_fraud)
-                    cust.print_trans(temp_tx_data, is_fraud, fraud_dates, static = is_static, scenario_identifier = need_identifier)
-                line_num += 1
-                if line_num > end_offset:
-                    break
-
-    if out_path is not None:
-        sys.stdout = original_sys_stdout
+    # only read this profile's customers of the task's range: from the binary store when there is one,
+    # else seeking straight to the range through the sidecar index
+    with stage('io.read_customers'):
+        rows = read_customers(customer_file, start_offset, end_offset, profile_name)
+    for row in rows:
+        generate_customer_transactions(Customer(row), profile, fraud_profile, start_date, end_date, is_static, need_identifier, writer, seed)
+
+    with stage('io.close'):
+        writer.close()
+    if profile_report:
+        return instrumentation.end_task(f'{profile_name} {start_offset}-{end_offset}', started)
+
+def main_work_unit(customer_file, profile_dir, profile_names, start_date, end_date, out_path, start_offset=0, end_offset=sys.maxsize, is_static = False, need_identifier = False, split_by_profile = False, output_format = 'csv', compression = None, seed = None, profile_report = False):
+    # Work unit mode: read the customer range once and generate the transactions of every profile in it.
+    # With split_by_profile, out_path is a pattern containing {profile} and each profile gets its own file.
+    if profile_report:
+        instrumentation.enable()
+        started = instrumentation.start_task()
+
+    if shared_merchants != is_static: # not already installed by init_worker
+        with stage('io.read_merchants'):
+            read_merchants(is_static)
+
+    outputs = {}
+    def output_for(profile_name):
+        key = profile_name if split_by_profile else None
+        if key not in outputs:
+            outputs[key] = open_output(out_path.format(profile=profile_name.replace('.json', '')) if split_by_profile else out_path, output_format, compression)
+        return outputs[key]
+
+    if not split_by_profile:
+        output_for(None)
+
+    with stage('io.read_customers'):
+        rows = read_customers(customer_file, start_offset, end_offset)
+    for row in rows:
+        cust = Customer(row)
+        profile_name = cust.attrs['profile']
+        if profile_name not in profile_names:
+            continue
+        profile, fraud_profile = load_profiles(pathlib.Path(profile_dir, profile_name), start_date, end_date)
+        generate_customer_transactions(cust, profile, fraud_profile, start_date, end_date, is_static, need_identifier, output_for(profile_name), seed)
+
+    with stage('io.close'):
+        for writer in outputs.values():
+            writer.close()
+    if profile_report:
+        return instrumentation.end_task(f'work unit {start_offset}-{end_offset}', started)
 
 
 if __name__ == '__main__':
@@ -254,6 +492,9 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', type=pathlib.Path, help='Output file path')
     parser.add_argument('-s', '--static_merchants', action='store_true', help='Whether generate merchants with static coordinates and identify high-risk merchants') # Static merchants switch
     parser.add_argument('-i', '--scenario_identifier', action='store_true', help='Mark scenario-generated transactions with scenario markers')
+    parser.add_argument('-f', '--format', choices=['csv', 'columnar'], help='Output format: pipe-delimited text or columnar binary chunks (columnar.py)', default='csv')
+    parser.add_argument('-z', '--compression', choices=sorted(compressors), help='Compress text output while writing it', default=None)
+    parser.add_argument('-seed', type=int, help='Seed of the per-customer random streams (unseeded if not given)', default=None)
 
     args = parser.parse_args()
 
@@ -262,8 +503,10 @@ if __name__ == '__main__':
     start_date = args.start_date
     end_date = args.end_date
     out_path = args.output
+    if args.format == 'columnar' and out_path is None:
+        parser.error('-f columnar writes a folder, it needs an output path (-o)')
     if_static = bool(args.static_merchants)
     need_identifier = bool(args.scenario_identifier)
 
-    main(customer_file, profile_file, start_date, end_date, out_path, static = if_static, scenario_identifier=need_identifier)
+    main(customer_file, profile_file, start_date, end_date, out_path, is_static = if_static, need_identifier = need_identifier, output_format = args.format, compression = args.compression, seed = args.seed)
     
\ No newline at end of file
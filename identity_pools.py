@@ -0,0 +1,107 @@
+### Pre-built pools of Faker identities, cached on disk so repeat runs can skip Faker entirely.
+### Generators draw from the pools by integer index, in vectorized batches.
+
+import os
+import glob
+
+from faker import Faker
+import numpy as np
+
+from sinks import atomic_write
+
+POOL_VERSION = 1 # bump whenever the pool layout or the Faker calls below change, old caches are then ignored
+default_pool_dir = './pools'
+
+# field -> (Faker call, dtype). Unique fields are consumed sequentially and never handed out twice.
+unique_fields = {
+    'ssn': (lambda fake: fake.ssn(), 'U11'),
+    'cc_num': (lambda fake: fake.credit_card_number(), 'U19'),
+    'acct_num': (lambda fake: str(fake.random_number(digits=12)), 'U12'),
+}
+sampled_fields = {
+    'first_male': (lambda fake: fake.first_name_male(), None),
+    'first_female': (lambda fake: fake.first_name_female(), None),
+    'last': (lambda fake: fake.last_name(), None),
+    'street': (lambda fake: fake.street_address(), None),
+    'job': (lambda fake: fake.job(), None),
+    'company': (lambda fake: fake.company(), None),
+}
+
+
+def round_up(n, step=100000):
+    return max(step, -(-n // step) * step)
+
+
+class IdentityPools:
+    # unique_size: number of unique ssn/cc_num/acct_num values required (at least the number of customers)
+    # sample_size: number of values in the pools sampled with replacement (names, streets, jobs, companies)
+
+    def __init__(self, unique_size, seed=42, path=default_pool_dir, sample_size=100000):
+        self.seed = seed
+        self.sample_size = sample_size
+        self.root = os.path.join(path, f'v{POOL_VERSION}')
+        self.unique_size = self.cached_unique_size(round_up(unique_size))
+        self.rng = np.random.default_rng(seed)
+        self.pools = {}
+        self.next_unique = 0
+
+    def cached_unique_size(self, needed):
+        # reuse the smallest cached pool that is big enough instead of building a new one
+        sizes = []
+        for d in glob.glob(os.path.join(self.root, f'seed{self.seed}_unique*_sample{self.sample_size}')):
+            size = int(os.path.basename(d).split('_')[1][len('unique'):])
+            if size >= needed and all(os.path.exists(os.path.join(d, f'{f}.npy')) for f in unique_fields):
+                sizes.append(size)
+        return min(sizes) if sizes else needed
+
+    @property
+    def pool_dir(self):
+        return os.path.join(self.root, f'seed{self.seed}_unique{self.unique_size}_sample{self.sample_size}')
+
+    def get(self, field):
+        # load a pool (memory-mapped), building and caching it first if needed
+        if field not in self.pools:
+            path = os.path.join(self.pool_dir, f'{field}.npy')
+            if not os.path.exists(path):
+                self.build(field, path)
+            self.pools[field] = np.load(path, mmap_mode='r')
+        return self.pools[field]
+
+    def build(self, field, path):
+        # every field gets its own seeded Faker instance so pools do not depend on build order
+        fake = Faker()
+        fake.seed_instance(f'{self.seed}-{field}')
+        if field in unique_fields:
+            make, dtype = unique_fields[field]
+            seen = set()
+            values = []
+            while len(values) < self.unique_size:
+                v = make(fake)
+                if v not in seen:
+                    seen.add(v)
+                    values.append(v)
+        else:
+            make, dtype = sampled_fields[field]
+            values = [make(fake) for _ in range(self.sample_size)]
+        values = np.array(values, dtype=dtype)
+
+        # write to a temporary file first, so an interrupted build never leaves a truncated pool behind
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path, 'wb') as f:
+            np.save(f, values)
+
+    def draw(self, field, idx):
+        return self.get(field)[idx]
+
+    def sample(self, field, n, rng=None):
+        # n values drawn with replacement
+        pool = self.get(field)
+        return pool[(rng or self.rng).integers(0, len(pool), n)]
+
+    def take_unique(self, n):
+        # the next n unused ssn/cc_num/acct_num values; pools are in random order already
+        start, end = self.next_unique, self.next_unique + n
+        if end > self.unique_size:
+            raise ValueError(f'Identity pool exhausted: {end} unique identities requested, pool holds {self.unique_size}')
+        self.next_unique = end
+        return {field: self.get(field)[start:end] for field in unique_fields}
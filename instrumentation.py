@@ -0,0 +1,117 @@
+### Optional per-stage timers and counters (datagen.py --profile-report).
+### Off by default: stage() then returns a shared no-op context manager and count() returns at once, so the
+### instrumented hot paths only pay a function call and a global check.
+### When on, every task records its timers, counters and tracemalloc peak, and the parent aggregates the reports.
+
+import json
+import time
+import tracemalloc
+
+enabled = False
+timers = {} # stage name -> [calls, seconds]
+counters = {} # counter name -> total
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        timer = timers.get(self.name)
+        if timer is None:
+            timer = timers[self.name] = [0, 0.0]
+        timer[0] += 1
+        timer[1] += time.perf_counter() - self.start
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_no_stage = _NoStage()
+
+
+def stage(name):
+    # with stage('transactions.merchants'): ...
+    return _Stage(name) if enabled else _no_stage
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def start_task():
+    # resets the timers and counters of this process and starts tracking allocations
+    timers.clear()
+    counters.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    return time.perf_counter()
+
+
+def end_task(label, started):
+    # report of the task started at started (see start_task)
+    _, peak = tracemalloc.get_traced_memory()
+    return {
+        'task': label,
+        'seconds': time.perf_counter() - started,
+        'tracemalloc_peak_mb': peak / (1 << 20),
+        'timers': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in timers.items()},
+        'counters': dict(counters),
+    }
+
+
+def aggregate(reports):
+    # totals over the task reports: stage timers and counters summed, largest tracemalloc peak
+    total = {'tasks': len(reports), 'seconds': 0.0, 'max_tracemalloc_peak_mb': 0.0, 'timers': {}, 'counters': {}}
+    for report in reports:
+        total['seconds'] += report['seconds']
+        total['max_tracemalloc_peak_mb'] = max(total['max_tracemalloc_peak_mb'], report['tracemalloc_peak_mb'])
+        for name, timer in report['timers'].items():
+            agg = total['timers'].setdefault(name, {'calls': 0, 'seconds': 0.0})
+            agg['calls'] += timer['calls']
+            agg['seconds'] += timer['seconds']
+        for name, n in report['counters'].items():
+            total['counters'][name] = total['counters'].get(name, 0) + n
+    return total
+
+
+def format_report(total):
+    lines = [f"{total['tasks']} tasks, {total['seconds']:.2f}s of task time, max tracemalloc peak {total['max_tracemalloc_peak_mb']:.1f} MB"]
+    lines.append(f"{'stage':<36}{'calls':>12}{'seconds':>12}{'% task time':>13}")
+    for name, timer in sorted(total['timers'].items(), key=lambda item: -item[1]['seconds']):
+        share = 100 * timer['seconds'] / total['seconds'] if total['seconds'] else 0
+        lines.append(f"{name:<36}{timer['calls']:>12}{timer['seconds']:>12.3f}{share:>12.1f}%")
+    for name, n in sorted(total['counters'].items()):
+        lines.append(f"{name:<36}{n:>12}")
+    return "\n".join(lines)
+
+
+def write_report(path, reports):
+    # JSON report (per-task reports and totals) at path, text summary next to it; returns the summary
+    total = aggregate(reports)
+    with open(path, 'w') as f:
+        json.dump({'total': total, 'tasks': reports}, f, indent=1)
+    text = format_report(total)
+    with open(f'{path}.txt', 'w') as f:
+        f.write(text + "\n")
+    return text
@@ -1,10 +1,15 @@
 import json
 
+import numpy as np
+
+leftovers = 'leftovers.json' # profile of the customers no profile of the config matches
+
 
 class MainConfig:
 
     def __init__(self, main):
         self.config = self.all_profiles_dicts(main)
+        self.compile()
 
     # convert type to a tuple
     def convert_config_type(self, x):
@@ -29,3 +34,57 @@ class MainConfig:
                         all_profiles[pf][qual] = \
                         self.convert_config_type(main_config[pf][qual])
             return all_profiles
+
+    def compile(self):
+        # Lookup table gender x age cell x city_pop cell -> profile id. The cells lie between the sorted bounds of
+        # all the profiles, so within a cell every customer matches the same profiles: the first one in config
+        # order wins, as with a scan of the profiles, and overlaps and gaps are found here once.
+        self.names = list(self.config) + [leftovers]
+        self.genders = sorted({g for p in self.config.values() for g in p['gender']})
+        self.age_breaks = np.array(sorted({b for p in self.config.values() for b in p['age'] if b != float('inf')}))
+        self.pop_breaks = np.array(sorted({b for p in self.config.values() for b in p['city_pop'] if b != float('inf')}))
+        # cell i covers [breaks[i-1], breaks[i]), cell 0 starts at -inf and the last one ends at +inf
+        age_lows = [float('-inf')] + self.age_breaks.tolist()
+        pop_lows = [float('-inf')] + self.pop_breaks.tolist()
+        age_highs = self.age_breaks.tolist() + [float('inf')]
+        pop_highs = self.pop_breaks.tolist() + [float('inf')]
+        self.table = np.full((len(self.genders) + 1, len(age_lows), len(pop_lows)), len(self.names) - 1, dtype=np.int32)
+        self.overlaps = [] # (profiles, gender, (age low, age high), (city_pop low, city_pop high))
+        self.gaps = [] # (gender, age range, city_pop range) of the non-negative cells left to leftovers.json
+        for g, gender in enumerate(self.genders):
+            for a, age in enumerate(age_lows):
+                for c, city_pop in enumerate(pop_lows):
+                    match = [i for i, p in enumerate(self.config.values())
+                             if gender in p['gender'] and p['age'][0] <= age < p['age'][1] and p['city_pop'][0] <= city_pop < p['city_pop'][1]]
+                    cell = (gender, (age, age_highs[a]), (city_pop, pop_highs[c]))
+                    if match:
+                        self.table[g, a, c] = match[0]
+                    elif age_highs[a] > 0 and pop_highs[c] > 0:
+                        self.gaps.append(cell)
+                    if len(match) > 1:
+                        self.overlaps.append(([self.names[i] for i in match],) + cell)
+
+    def write_warnings(self, path='profile_overlap_warnings.log'):
+        # overlapping profiles (the first one is used) and gaps of the config, if any
+        if self.overlaps or self.gaps:
+            with open(path, 'a') as f:
+                for names, gender, ages, pops in self.overlaps:
+                    f.write(f"{' '.join(names)}: {gender} age [{ages[0]}, {ages[1]}) city_pop [{pops[0]}, {pops[1]})\n")
+                for gender, ages, pops in self.gaps:
+                    f.write(f"{leftovers}: {gender} age [{ages[0]}, {ages[1]}) city_pop [{pops[0]}, {pops[1]})\n")
+
+    def profile_ids(self, genders, ages, city_pops):
+        # vectorized profile lookup: ids into self.names of arrays of genders, ages and city populations
+        gender_index = {gender: g for g, gender in enumerate(self.genders)}
+        g = np.array([gender_index.get(gender, len(self.genders)) for gender in genders], dtype=np.int64)
+        a = np.searchsorted(self.age_breaks, np.asarray(ages, dtype=float), side='right')
+        c = np.searchsorted(self.pop_breaks, np.asarray(city_pops, dtype=float), side='right')
+        return self.table[g, a, c]
+
+    def assign(self, genders, ages, city_pops):
+        # profile file names of arrays of customers
+        return [self.names[i] for i in self.profile_ids(genders, ages, city_pops).tolist()]
+
+    def match(self, gender, age, city_pop):
+        # profile file name of one customer
+        return self.assign([gender], [age], [city_pop])[0]
@@ -0,0 +1,233 @@
+### Shard manifests: with --shard i/N, each datagen.py run writes manifest_shard<i>-of-<N>.json next to its output,
+### listing the tasks it ran and its files with row counts and checksums.
+### `python manifests.py merge-manifests <dirs or manifests>` checks that the shards of a run are complete
+### and consistent, and writes the combined dataset index.
+### Run manifests: datagen.py checkpoints every finished task (files, row counts, checksums) in run_manifest.json,
+### so --resume can skip them after a crash and --extend-to can add a date window to the same customers.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+from columnar import ColumnarReader
+from customer_index import file_signature, signature_keys
+from sinks import open_file, atomic_write
+
+MANIFEST_VERSION = 1
+RUN_MANIFEST_VERSION = 2
+
+
+def parse_shard(s):
+    # argparse type of --shard: 'i/N' with 0 <= i < N
+    try:
+        index, count = (int(x) for x in s.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a valid shard: {s!r}, expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"not a valid shard: {s!r}, expected 0 <= i < N")
+    return index, count
+
+
+def shard_tasks(tasks, shard):
+    # the (task id, task) pairs of a shard: round robin over the full, deterministic task list
+    index, count = shard
+    return [(task_id, task) for task_id, task in enumerate(tasks) if task_id % count == index]
+
+
+def manifest_name(shard):
+    return f'manifest_shard{shard[0]}-of-{shard[1]}.json'
+
+
+def checksum(path):
+    # sha256 of a file, or of the files of a columnar chunk folder (names and contents, in name order)
+    h = hashlib.sha256()
+    paths = [path] if os.path.isfile(path) else sorted(glob.glob(os.path.join(path, '*')))
+    for p in paths:
+        if p != path:
+            h.update(os.path.basename(p).encode())
+        with open(p, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def count_rows(path):
+    # data rows of a csv file (header excluded) or of a columnar chunk
+    if os.path.isdir(path):
+        return ColumnarReader(path).rows
+    with open_file(path, 'rb') as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def disk_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(p) for p in glob.glob(os.path.join(path, '*')))
+    return os.path.getsize(path)
+
+
+def task_files(out_pattern):
+    # output files of a task; work units split by profile write '{profile}_...' files, one per profile met
+    if '{profile}' in out_pattern:
+        return sorted(glob.glob(out_pattern.replace('{profile}', '*')))
+    return [out_pattern] if os.path.exists(out_pattern) else []
+
+
+def file_entry(path, root, task_id):
+    return {
+        'path': os.path.relpath(path, root),
+        'task': task_id,
+        'rows': count_rows(path),
+        'bytes': disk_size(path),
+        'sha256': checksum(path),
+    }
+
+
+def write_manifest(out_dir, shard, run, tasks_total, shard_outputs):
+    # run: the parameters all the shards of a run must share (seed, dates, customers, chunk size, format...)
+    # shard_outputs: (task id, output path or pattern) of the tasks run by this shard
+    files = [file_entry(path, out_dir, task_id) for task_id, out_pattern in shard_outputs for path in task_files(out_pattern)]
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'shard': list(shard),
+        'run': run,
+        'tasks_total': tasks_total,
+        'tasks': [task_id for task_id, _ in shard_outputs],
+        'rows': sum(f['rows'] for f in files),
+        'files': files,
+    }
+    path = os.path.join(out_dir, manifest_name(shard))
+    with atomic_write(path) as f:
+        json.dump(manifest, f, indent=1)
+    return path
+
+
+def run_manifest_name(shard=None):
+    return 'run_manifest.json' if shard is None else f'run_manifest_shard{shard[0]}-of-{shard[1]}.json'
+
+
+def load_run_manifest(path):
+    # the run manifest at path, None if there is none. Raises ValueError for another manifest version
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest['version'] != RUN_MANIFEST_VERSION:
+        raise ValueError(f'{path}: unsupported run manifest version {manifest["version"]}')
+    return manifest
+
+
+def write_run_manifest(path, manifest):
+    # a crash never leaves a truncated manifest behind
+    with atomic_write(path) as f:
+        json.dump(manifest, f, indent=1)
+
+
+def reference_entry(path):
+    # a file the tasks of a run are generated from (customers, static merchants), with its signature
+    return {'path': str(path), **file_signature(path)}
+
+
+def reference_changed(entry):
+    # whether a recorded reference file is missing or was rewritten since, even with the same size
+    return not os.path.exists(entry['path']) or file_signature(entry['path']) != {key: entry.get(key) for key in signature_keys}
+
+
+def task_done(manifest, task_id, out_dir):
+    # whether a task is recorded as completed and its files are still there, with the recorded sizes
+    entries = manifest['completed'].get(str(task_id))
+    if entries is None:
+        return False
+    return all(os.path.exists(os.path.join(out_dir, e['path'])) and disk_size(os.path.join(out_dir, e['path'])) == e['bytes'] for e in entries)
+
+
+def find_manifests(paths):
+    # manifest files given directly or found in the given folders
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, 'manifest_shard*-of-*.json'))))
+        else:
+            found.append(path)
+    return found
+
+
+def merge_manifests(paths, index_path, verify=False):
+    # check the shards of a run are all there, disjoint and complete, then write the combined dataset index.
+    # Raises ValueError listing the problems found.
+    manifests = []
+    for path in find_manifests(paths):
+        with open(path, 'r') as f:
+            manifests.append((path, json.load(f)))
+    if not manifests:
+        raise ValueError('No shard manifest found')
+
+    errors = []
+    first = manifests[0][1]
+    shard_count = first['shard'][1]
+    seen_shards = {}
+    seen_tasks = {}
+    files = []
+    for path, manifest in manifests:
+        if manifest['version'] != MANIFEST_VERSION:
+            errors.append(f'{path}: unsupported manifest version {manifest["version"]}')
+            continue
+        if manifest['run'] != first['run'] or manifest['tasks_total'] != first['tasks_total'] or manifest['shard'][1] != shard_count:
+            errors.append(f'{path}: generated with different parameters than {manifests[0][0]}')
+            continue
+        index = manifest['shard'][0]
+        if index in seen_shards:
+            errors.append(f'{path}: shard {index} already given by {seen_shards[index]}')
+            continue
+        seen_shards[index] = path
+        for task_id in manifest['tasks']:
+            if task_id in seen_tasks:
+                errors.append(f'{path}: task {task_id} also run by {seen_tasks[task_id]}')
+            seen_tasks[task_id] = path
+        root = os.path.dirname(os.path.abspath(path))
+        for entry in manifest['files']:
+            file_path = os.path.join(root, entry['path'])
+            if not os.path.exists(file_path):
+                errors.append(f'{path}: missing file {entry["path"]}')
+            elif disk_size(file_path) != entry['bytes'] or (verify and checksum(file_path) != entry['sha256']):
+                errors.append(f'{path}: {entry["path"]} does not match its manifest entry')
+            files.append({**entry, 'path': os.path.relpath(file_path, os.path.dirname(os.path.abspath(index_path))), 'shard': index})
+
+    missing_shards = sorted(set(range(shard_count)) - set(seen_shards))
+    if missing_shards:
+        errors.append(f'missing shards: {missing_shards} of {shard_count}')
+    missing_tasks = sorted(set(range(first['tasks_total'])) - set(seen_tasks))
+    if missing_tasks and not missing_shards:
+        errors.append(f'tasks never run: {missing_tasks}')
+    if errors:
+        raise ValueError('\n'.join(errors))
+
+    files.sort(key=lambda entry: (entry['task'], entry['path']))
+    index = {
+        'version': MANIFEST_VERSION,
+        'run': first['run'],
+        'shards': shard_count,
+        'rows': sum(entry['rows'] for entry in files),
+        'files': files,
+    }
+    with atomic_write(index_path) as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sparkov: shard manifests')
+    commands = parser.add_subparsers(dest='command', required=True)
+    merge = commands.add_parser('merge-manifests', help='Check the shards of a run and write the combined dataset index')
+    merge.add_argument('paths', nargs='+', help='Shard output folders or manifest files')
+    merge.add_argument('-o', '--output', help='Dataset index file', default='dataset_index.json')
+    merge.add_argument('--verify', action='store_true', help='Also recompute the checksum of every file')
+
+    args = parser.parse_args()
+    try:
+        index = merge_manifests(args.paths, args.output, args.verify)
+    except ValueError as e:
+        print(e)
+        exit(1)
+    print(f"{index['shards']} shards, {len(index['files'])} files, {index['rows']} rows -> {args.output}")
@@ -0,0 +1,166 @@
+### External merge of the transaction chunks into a single file ordered by unix_time.
+### Each chunk is sorted in memory into a run file, then the runs are k-way merged with a heap, at most fan_in
+### runs at a time (extra merge passes through temporary files otherwise), so memory stays bounded by the
+### largest chunk. The time axis can be cut into ranges merged in parallel; their parts are concatenated
+### at the end (concatenated gzip/lzma/bz2 streams are still valid files).
+### Ties on unix_time are broken on the whole row, so the output does not depend on fan_in, ranges or workers.
+
+import argparse
+import glob
+import heapq
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+from sinks import compressed_path, compressors, extensions, open_file, atomic_write
+
+default_fan_in = 64
+samples_per_chunk = 256 # unix_time samples per chunk used to balance the time ranges
+
+
+def unix_time_column(header):
+    return header.decode().rstrip('\r\n').split('|').index('unix_time')
+
+
+def row_key(col):
+    return lambda line: (int(line.split(b'|', col + 1)[col]), line)
+
+
+def sort_chunk(path, run_path):
+    # sorts one chunk into run_path, with the sorted unix_times and line offsets of the run next to it.
+    # Returns the header of the chunk and a sample of its unix_times
+    with open_file(path, 'rb') as f:
+        header = f.readline()
+        lines = f.readlines()
+    if lines and not lines[-1].endswith(b'\n'):
+        lines[-1] += b'\n'
+    col = unix_time_column(header)
+    lines.sort(key=row_key(col))
+    keys = np.fromiter((int(line.split(b'|', col + 1)[col]) for line in lines), dtype=np.int64, count=len(lines))
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(line) for line in lines])
+    with open(run_path, 'wb') as f:
+        f.writelines(lines)
+    np.save(f'{run_path}.keys.npy', keys)
+    np.save(f'{run_path}.offsets.npy', offsets)
+    return header, keys[::max(1, len(keys) // samples_per_chunk)]
+
+
+def read_run(path, start, count):
+    # count lines of a run file from byte offset start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for _ in range(count):
+            yield f.readline()
+
+
+def merge_sources(sources, f, col):
+    # heap merge of (run path, start offset, line count) sources into the open binary file f
+    f.writelines(heapq.merge(*[read_run(*source) for source in sources], key=row_key(col)))
+
+
+def merge_range(runs, lo, hi, part_path, header, col, compression, fan_in, tmp_dir):
+    # merges the rows lo <= unix_time < hi of all the runs into part_path (with the header, if given)
+    sources = []
+    for run in runs:
+        keys = np.load(f'{run}.keys.npy', mmap_mode='r')
+        i, j = np.searchsorted(keys, [lo, hi], side='left').tolist()
+        if j > i:
+            sources.append((run, int(np.load(f'{run}.offsets.npy', mmap_mode='r')[i]), j - i))
+
+    # merge passes until at most fan_in sources are left
+    level = 0
+    intermediates = []
+    while len(sources) > fan_in:
+        merged = []
+        for g in range(0, len(sources), fan_in):
+            group = sources[g:g + fan_in]
+            path = os.path.join(tmp_dir, f'{os.path.basename(part_path)}.pass{level}.{g // fan_in}')
+            with open(path, 'wb') as f:
+                merge_sources(group, f, col)
+            merged.append((path, 0, sum(source[2] for source in group)))
+        for path in intermediates:
+            os.remove(path)
+        intermediates = [source[0] for source in merged]
+        sources = merged
+        level += 1
+
+    with open_file(part_path, 'wb', compression) as f:
+        if header is not None:
+            f.write(header)
+        merge_sources(sources, f, col)
+    for path in intermediates:
+        os.remove(path)
+    return sum(source[2] for source in sources)
+
+
+def chunk_files(folder, exclude=()):
+    # the csv transaction chunks of an output folder, plain or compressed
+    exclude = {os.path.abspath(path) for path in exclude}
+    files = []
+    for pattern in ['*.csv'] + [f'*.csv{ext}' for ext in extensions.values()]:
+        files.extend(glob.glob(os.path.join(folder, pattern)))
+    return sorted(path for path in files if os.path.abspath(path) not in exclude)
+
+
+def merge_transactions(files, out_path, fan_in=default_fan_in, ranges=1, workers=None, compression=None, tmp_dir=None):
+    # writes the rows of all the csv chunk files into out_path ordered by unix_time, returns the row count.
+    # ranges > 1 merges that many time ranges (balanced on a sample of unix_times) in parallel
+    if fan_in < 2:
+        raise ValueError('fan_in must be at least 2')
+    out_path = compressed_path(out_path, compression)
+    tmp = tempfile.mkdtemp(prefix='merge_', dir=tmp_dir or os.path.dirname(os.path.abspath(out_path)))
+    try:
+        runs = [os.path.join(tmp, f'run{i}') for i in range(len(files))]
+        with Pool(workers) as p:
+            sorted_chunks = p.starmap(sort_chunk, zip(files, runs))
+            headers = {header for header, _ in sorted_chunks}
+            if len(headers) > 1:
+                raise ValueError('The chunks do not all have the same columns')
+            if not headers:
+                raise ValueError('No chunk to merge')
+            header = headers.pop()
+            col = unix_time_column(header)
+
+            # range bounds at quantiles of the sampled unix_times
+            samples = np.concatenate([sample for _, sample in sorted_chunks])
+            inner = np.quantile(samples, np.linspace(0, 1, ranges + 1)[1:-1]).astype(np.int64).tolist() if len(samples) else []
+            bounds = [np.iinfo(np.int64).min] + inner + [np.iinfo(np.int64).max]
+            parts = [f'{out_path}.part{r}' for r in range(ranges)]
+            rows = p.starmap(merge_range, [
+                (runs, bounds[r], bounds[r + 1], parts[r], header if r == 0 else None, col, compression, fan_in, tmp)
+                for r in range(ranges)])
+
+        with atomic_write(out_path, 'wb') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+                os.remove(part)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return sum(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sparkov: merge transaction chunks into one file ordered by unix_time')
+    parser.add_argument('inputs', nargs='+', help='Output folders of datagen.py, or chunk files')
+    parser.add_argument('-o', '--output', help='Merged output file', required=True)
+    parser.add_argument('--fan_in', type=int, help='Maximum number of runs merged at once', default=default_fan_in)
+    parser.add_argument('--ranges', type=int, help='Number of time ranges merged in parallel', default=1)
+    parser.add_argument('--workers', type=int, help='Worker processes (default: number of CPUs)', default=None)
+    parser.add_argument('-z', '--compression', choices=sorted(compressors), help='Compress the merged file', default=None)
+    parser.add_argument('--tmp_dir', help='Folder of the temporary run files (default: next to the output)', default=None)
+
+    args = parser.parse_args()
+    out_path = compressed_path(args.output, args.compression)
+    files = []
+    for path in args.inputs:
+        files.extend(chunk_files(path, exclude=[out_path]) if os.path.isdir(path) else [path])
+    try:
+        rows = merge_transactions(files, out_path, args.fan_in, args.ranges, args.workers, args.compression, args.tmp_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{len(files)} chunks, {rows} rows -> {out_path}")
@@ -1,43 +1,48 @@
 import sys
+import os
+import json
+import hashlib
 from datetime import datetime, timedelta, time, date
-import random
 import numpy as np
-from faker import Faker
-from bisect import bisect_left
+
+from cdf_sampler import CDFSampler
+from instrumentation import stage
+from sinks import atomic_write
+
+COMPILED_VERSION = 1
+default_cache_dir = './profile_cache'
+cache_dir = None # folder the compiled date ranges are persisted in (opt-in, datagen.py sets default_cache_dir)
+compiled_ranges = {} # (profile hash, start, end) -> (days, day weights without the year weights), per process
+
+
+def profile_hash(profile):
+    # content hash of a profile dict, keys of the compiled date ranges
+    return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:16]
 
 
 class Profile:
-    def __init__(self, profile):
+    def __init__(self, profile, use_cache=True):
         self.profile = profile
+        self.use_cache = use_cache # False: compile every date range, without the process memo or the disk cache
+        self.hash = profile_hash(profile)
         self.proportions = {}
         # form profile so it can be sampled from
-        self.proportions['categories_wt'] = self.weight_to_cumsum(self.profile['categories_wt'])
-        self.proportions['shopping_time'] = self.weight_to_cumsum(self.profile['shopping_time']) ###BRANDON
-        self.proportions['date_wt'] = {}
-        self.proportions['date_wt']['day_of_week'] = self.prep_weekday()
-        years_wt, leap_wt = self.prep_holidays()
-        self.proportions['date_wt']['time_of_year'] = years_wt
-        self.proportions['date_wt']['time_of_year_leap'] = leap_wt
+        self.category_sampler = CDFSampler.from_weights(self.profile['categories_wt'])
+        self.daypart_sampler = CDFSampler.from_weights(self.profile['shopping_time']) ###BRANDON
+        self.proportions['date_wt'] = {} # calendar proportions, only prepared when a date range has to be compiled
+        self.compiled = None # (days, day weights without year weights) of the last compiled date range
         self.amt_specs = self.pre_compute_amt_specs()
-        self.fake = Faker()
-        # Faker.seed(0)
+        # gamma parameters aligned with the category sampler labels, for vectorized amount draws
+        self.amt_shape = np.array([self.amt_specs[c]['shape'] for c in self.category_sampler.labels])
+        self.amt_scale = np.array([self.amt_specs[c]['scale'] for c in self.category_sampler.labels])
+        self.category_labels = np.array(self.category_sampler.labels)
+        self.daypart_is_pm = np.array(self.daypart_sampler.labels) == 'PM'
 
     def set_date_range(self, start, end):
         self.start = start
         self.end = end
-        self.make_weights()
-
-    # turn dict into cumulative sum key
-    # with entry value so we can sample
-    def weight_to_cumsum(self, weights):
-        wt_tot = sum(weights.values())
-        cumsum = 0
-        temp_cat = {}
-        for k in weights:
-            cumsum += weights[k]/float(wt_tot)
-            temp_cat[k] = cumsum
-        # invert
-        return {temp_cat[k]: k for k in temp_cat}
+        with stage('profile.set_date_range'):
+            self.make_weights()
 
     def weight_to_prop(self, weights):
         wt_tot = sum(weights.values())
@@ -124,29 +129,70 @@ class Profile:
                 final_year[y] = 100
         return self.weight_to_prop(final_year)
 
-    def combine_date_params(self, weights):
-        new_date_weights = {}
-        curr = self.start
-        while curr <= self.end:
-            # leap year:
-            if curr.year%4 == 0:
-                time_name = 'time_of_year_leap'
-            else:
-                time_name = 'time_of_year'
+    def prep_calendar(self):
+        # day of week and time of year proportions, as combine_date_params used them
+        if not self.proportions['date_wt']:
+            self.proportions['date_wt']['day_of_week'] = self.prep_weekday()
+            years_wt, leap_wt = self.prep_holidays()
+            self.proportions['date_wt']['time_of_year'] = years_wt
+            self.proportions['date_wt']['time_of_year_leap'] = leap_wt
+        return self.proportions['date_wt']
 
-            date_wt = (weights['year'][curr.year]
-                     * weights[time_name][(curr.month,curr.day)]
-                     * weights['day_of_week'][curr.weekday()])
+    def compile_days(self, start, end):
+        # every day of start..end with its time of year x day of week weight (the year weights depend on the
+        # range sampled from, they are applied by date_weights). Vectorized version of the old day by day loop.
+        date_wt = self.prep_calendar()
+        days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        years = days.astype('datetime64[Y]').astype(int) + 1970
+        months = days.astype('datetime64[M]').astype(int) % 12 + 1
+        month_days = (days - days.astype('datetime64[M]')).astype(int) + 1
+        # time of year proportions indexed by month * 32 + day
+        leap, nonleap = np.zeros(13 * 32), np.zeros(13 * 32)
+        for (m, d), wt in date_wt['time_of_year_leap'].items():
+            leap[m * 32 + d] = wt
+        for (m, d), wt in date_wt['time_of_year'].items():
+            nonleap[m * 32 + d] = wt
+        weekdays = np.array([date_wt['day_of_week'][d] for d in range(7)])
+        md = months * 32 + month_days
+        time_of_year = np.where(years % 4 == 0, leap[md], nonleap[md])
+        return days, time_of_year * weekdays[(days.astype(int) + 3) % 7] # 1970-01-01 was a thursday
 
-            new_date_weights[curr] = date_wt
-            curr += timedelta(days=1)
-        # re-weight to get proportions
-        return self.weight_to_prop(new_date_weights)
+    def load_compiled(self, start, end):
+        # compiled days of a range: from the process memo, the disk cache, or compiled and stored in both
+        if not self.use_cache:
+            return self.compile_days(start, end)
+        key = (self.hash, str(np.datetime64(start, 'D')), str(np.datetime64(end, 'D')))
+        if key in compiled_ranges:
+            return compiled_ranges[key]
+        path = os.path.join(cache_dir, f'v{COMPILED_VERSION}_{key[0]}_{key[1]}_{key[2]}.npz') if cache_dir else None
+        if path and os.path.exists(path):
+            with np.load(path) as f:
+                compiled = (f['days'], f['weights'])
+        else:
+            compiled = self.compile_days(start, end)
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                # concurrent workers never read a partial file
+                with atomic_write(path, 'wb') as f:
+                    np.savez(f, days=compiled[0], weights=compiled[1])
+        compiled_ranges[key] = compiled
+        return compiled
 
     def date_weights(self):
-        self.proportions['date_wt']['year'] = self.prep_years()
-        weights = self.combine_date_params(self.proportions['date_wt'])
-        self.proportions['date_prop'] = self.weight_to_cumsum(weights)
+        start, end = np.datetime64(self.start, 'D'), np.datetime64(self.end, 'D')
+        if self.compiled is not None and self.compiled[0][0] <= start and end <= self.compiled[0][-1]:
+            # range within the compiled one (e.g. a fraud window): a slice of its day weights
+            window = slice(int((start - self.compiled[0][0]).astype(int)), int((end - self.compiled[0][0]).astype(int)) + 1)
+            days, weights = self.compiled[0][window], self.compiled[1][window]
+        else:
+            self.compiled = self.load_compiled(self.start, self.end)
+            days, weights = self.compiled
+        years_wt = self.prep_years()
+        first_year = int(days[0].astype('datetime64[Y]').astype(int)) + 1970
+        year_weights = np.array([years_wt[y] for y in range(first_year, first_year + len(years_wt))])
+        years = days.astype('datetime64[Y]').astype(int) + 1970 - first_year
+        self.date_sampler = CDFSampler(days, year_weights[years] * weights)
+        self.date_days = days
              
     # convert dates from weights to %
     def make_weights(self):
@@ -163,52 +209,36 @@ class Profile:
             }
         return amt_specs
 
-    def sample_time(self, am_or_pm, is_fraud):
-
-        if am_or_pm == 'AM':
-            hr_start = 0
-            hr_end = 12
-        if am_or_pm == 'PM':
-            hr_start = 12
-            hr_end = 24
+    def sample_times(self, is_pm, is_fraud, rng):
+        # vectorized hour/minute/second draws: AM is 0-11h, PM is 12-23h
+        n = len(is_pm)
+        hr_start = np.where(is_pm, 12, 0)
+        hr_end = hr_start + 12
 
         if is_fraud == 1:
             #20% chance that the fraud will still occur during normal hours
-            chance = (random.randint(1,100))
-            if chance > 20:
-                if am_or_pm == 'AM':
-                    hr_end = 4
-                if am_or_pm == 'PM':
-                    hr_start = 22
+            shifted = rng.integers(1, 101, n) > 20
+            hr_end = np.where(shifted & ~is_pm, 4, hr_end)
+            hr_start = np.where(shifted & is_pm, 22, hr_start)
 
-        hour = random.randrange(hr_start, hr_end, 1)
-        mins = random.randrange(60)
-        secs = random.randrange(60)
-        return [hour, mins, secs]
+        hours = hr_start + (rng.random(n) * (hr_end - hr_start)).astype(int)
+        mins = rng.integers(0, 60, n)
+        secs = rng.integers(0, 60, n)
+        return hours, mins, secs
 
-    def get_rand_2d(self, n, m, o):
-        x = [np.arange(n)]
-        for i in range(m):
-            x.append(np.random.random(n))
-        for j in range(o):
-            x.append(np.zeros(n))
-        return np.array(x).T
-        
-    def closest_rand_parallel(self, r, i, j, obj):
-        # get the closest number in obj keys from the number in col i, return in col j
-        lst = np.array(list(obj.keys())[::-1])
-        # sort by the ith colum
-        r2 = r[r[:,i].argsort()]
-        for x in lst:
-            r2[:,j] = np.where(r2[:,1] <= x, x, r2[:,j])
-        return r2
+    def trans_nums(self, n, rng):
+        # 128 random bits per transaction as 32 hex digits, like the md5 hashes Faker used to produce
+        return np.frombuffer(rng.bytes(16 * n).hex().encode(), dtype='S32').astype('U32')
 
-    def sample_from(self, is_fraud):
+    def sample_from(self, is_fraud, rng=None):
+        # rng: a numpy Generator, the customer's own stream (see datagen_transaction.customer_rngs)
+        if rng is None:
+            rng = np.random.default_rng()
 
         # randomly sample number of transactions
         num_trans = int((self.end - self.start).days *
-                np.random.randint(self.profile['avg_transactions_per_day']['min'], ## need normal, not uniform
-                                  self.profile['avg_transactions_per_day']['max'] + 1))
+                rng.integers(self.profile['avg_transactions_per_day']['min'], ## need normal, not uniform
+                             self.profile['avg_transactions_per_day']['max'] + 1))
 
         # randomly determine if customer is traveling based off of profile travel_pct param
         # if np.random.uniform() < self.profile['travel_pct']/100:
@@ -219,44 +249,42 @@ class Profile:
         # travel_max=1
         is_traveling = False
 
-        output = []
-
-        # get an 2d array of random numbers + empty columns for mapping
-        rnds = self.get_rand_2d(num_trans, 2, 4)
+        # independent weighted draws for the date, category and daypart of every transaction
+        with stage('profile.cdf_sampling'):
+            date_idx = self.date_sampler.sample_index(num_trans, rng)
+            cat_idx = self.category_sampler.sample_index(num_trans, rng)
+            daypart_idx = self.daypart_sampler.sample_index(num_trans, rng)
 
-        rnds = self.closest_rand_parallel(rnds, 1, 3, self.proportions['date_prop'])
-        rnds = self.closest_rand_parallel(rnds, 2, 5, self.proportions['shopping_time'])
-        rnds = self.closest_rand_parallel(rnds, 2, 4, self.proportions['categories_wt'])
+        # gamma amounts with the parameters of each transaction's category
+        rnd_amts = rng.gamma(self.amt_shape[cat_idx], self.amt_scale[cat_idx])
+        # as in previous version, when transactions are under $1, use uniform 1-10 range
+        rnd_amts_lower = rng.uniform(1.00, 10.00, num_trans)
+        amts = np.where(rnd_amts < 1, rnd_amts_lower, rnd_amts)
 
-        # get counts for each category
-        unique, counts = np.unique(rnds[:,4], return_counts=True)
-        # sort by category
-        rnds = rnds[rnds[:,5].argsort()]
-        offset = 0
-        # for each category get the number of sample amounts
-        for i, cat_prop in enumerate(unique):
-            cat_specs = self.amt_specs[self.proportions['categories_wt'][cat_prop]]
-            shape = cat_specs['shape']
-            scale = cat_specs['scale']
-            rnd_amts = np.random.gamma(shape, scale, counts[i])
-            # as in previous version, when transactions are under $1, use uniform 1-10 range
-            rnd_amts_lower = np.random.uniform(1.00, 10.00, counts[i])
-            rnds[offset: offset + counts[i], 6] = np.where(rnd_amts < 1, rnd_amts_lower, rnd_amts)
-            offset += counts[i]
+        dates = self.date_days[date_idx]
+        hours, mins, secs = self.sample_times(self.daypart_is_pm[daypart_idx], is_fraud, rng)
+        # local-time epoch: midnight of each distinct date is converted once, then the time of day is added.
+        # On days with a UTC offset change (DST) the rows are converted one by one, like datetime.timestamp() does
+        unique_dates, date_pos = np.unique(dates, return_inverse=True)
+        unique_days = unique_dates.tolist()
+        midnights = np.array([int(datetime.combine(d, time()).timestamp()) for d in unique_days], dtype=np.int64)
+        last_seconds = np.array([int(datetime.combine(d, time(23, 59, 59)).timestamp()) for d in unique_days], dtype=np.int64)
+        epochs = midnights[date_pos] + hours * 3600 + mins * 60 + secs
+        for i in np.flatnonzero((last_seconds - midnights != 86399)[date_pos]).tolist():
+            d = unique_days[date_pos[i]]
+            epochs[i] = int(datetime.combine(d, time(int(hours[i]), int(mins[i]), int(secs[i]))).timestamp())
 
-        fraud_dates = []
-        # now loop through and pick from random array
-        for i in range(num_trans):
-            trans_num = self.fake.md5(raw_output=False)
-            chosen_date = self.proportions['date_prop'][rnds[i, 3]]
-            chosen_date_str = chosen_date.strftime('%Y-%m-%d')
-            if is_fraud == 1:
-                fraud_dates.append(chosen_date_str)
-            chosen_cat = self.proportions['categories_wt'][rnds[i, 4]]
-            chosen_amt = "{:.2f}".format(rnds[i, 6])
-            chosen_daypart = self.proportions['shopping_time'][rnds[i, 5]]
-            hr, mn, sec = self.sample_time(chosen_daypart, is_fraud)
-            chosen_date = datetime.combine(chosen_date, time(hour=hr, minute=mn, second=sec))
-            epoch = int(chosen_date.timestamp())
-            output.append([str(trans_num), chosen_date_str, f"{hr:02d}:{mn:02d}:{sec:02d}", str(epoch), str(chosen_cat), str(chosen_amt), str(is_fraud)])
+        # columns of the whole batch, only turned into strings by the writer
+        output = {
+            'trans_num': self.trans_nums(num_trans, rng),
+            'trans_date': dates,
+            'hour': hours,
+            'minute': mins,
+            'second': secs,
+            'unix_time': epochs,
+            'category': self.category_labels[cat_idx],
+            'amt': amts,
+            'is_fraud': np.full(num_trans, str(is_fraud), dtype=object),
+        }
+        fraud_dates = unique_dates if is_fraud == 1 else unique_dates[:0]
         return output, is_traveling, travel_max, fraud_dates
@@ -0,0 +1,232 @@
+### Real-time replay: emits transactions in unix_time order at a controlled pace, for load-testing stream consumers.
+### Pacing is either a fixed rate (token bucket, --rate rows/s) or an accelerated wall clock (--speedup N: one
+### hour of transaction time is replayed in 1/N hour). Waiting is done with asyncio.sleep, never by spinning.
+### Rows go to stdout, a file, a Unix domain socket or a TCP socket; throughput and lag are reported on stderr.
+###
+###   python replay.py data/transactions_sorted.csv --rate 50000 --to tcp:localhost:9000
+###   python replay.py --live 1000 01-01-2023 12-31-2023 --speedup 86400 --to unix:/tmp/scorer.sock
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from merge_transactions import chunk_files, merge_transactions
+from sinks import open_file
+from utilities import valid_date
+
+batch_lines = 10000 # lines read from the source at a time
+
+
+class TokenBucket:
+    # rate tokens per second, at most burst of them saved up. take() sleeps for the missing tokens.
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate / 100)) # default: 10ms worth of rows
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def take(self, n):
+        self.refill()
+        if self.tokens < n:
+            await asyncio.sleep((n - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= n # may go slightly negative after a late wake-up, the next take() pays it back
+
+
+class FileTarget:
+    # stdout or a file, with the write/drain/close interface of asyncio.StreamWriter
+
+    def __init__(self, path=None):
+        self.f = sys.stdout.buffer if path is None else open_file(path, 'wb')
+        self.path = path
+
+    def write(self, data):
+        self.f.write(data)
+
+    async def drain(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.flush()
+        if self.path is not None:
+            self.f.close()
+
+    async def wait_closed(self):
+        pass
+
+
+async def open_target(target):
+    # '-' (stdout), 'unix:PATH', 'tcp:HOST:PORT' or a file path
+    if target == '-':
+        return FileTarget()
+    if target.startswith('unix:'):
+        _, writer = await asyncio.open_unix_connection(target[len('unix:'):])
+        return writer
+    if target.startswith('tcp:'):
+        host, port = target[len('tcp:'):].rsplit(':', 1)
+        _, writer = await asyncio.open_connection(host, int(port))
+        return writer
+    return FileTarget(target)
+
+
+class ReplayStats:
+    # rows sent, achieved throughput and lag (how late the last row was sent compared to its schedule)
+
+    def __init__(self, report_every):
+        self.report_every = report_every
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.rows = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def sent(self, n, due):
+        now = time.monotonic()
+        self.rows += n
+        self.lag = max(0.0, now - due)
+        self.max_lag = max(self.max_lag, self.lag)
+        if self.report_every and now - self.last_report >= self.report_every:
+            self.last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        print(f"{'total: ' if final else ''}{self.rows} rows in {elapsed:.1f}s, {self.rows / elapsed:.0f} rows/s, "
+              f"lag {self.lag * 1000:.1f}ms (max {self.max_lag * 1000:.1f}ms)", file=sys.stderr)
+
+
+def file_source(path):
+    # (header, batches of lines) of a time-ordered csv file, such as the output of merge_transactions.py
+    f = open_file(path, 'rb')
+    header = f.readline()
+
+    def batches():
+        with f:
+            while True:
+                lines = f.readlines(batch_lines * 256)
+                if not lines:
+                    return
+                yield lines
+    return header, batches()
+
+
+def live_source(nb_customers, start_date, end_date, **stream_args):
+    # (header, batches of lines) generated in-process by datagen_stream. The generator yields customer by customer,
+    # so the rows are sorted by unix_time in memory before the replay: meant for datasets that fit in RAM
+    from datagen_stream import stream_transactions, transaction_headers
+    time_col = transaction_headers.index('unix_time')
+    rows = [row for batch in stream_transactions(nb_customers, start_date, end_date, **stream_args) for row in batch]
+    rows.sort(key=lambda row: row[time_col])
+    header = ("|".join(transaction_headers) + "\n").encode()
+
+    def batches():
+        for i in range(0, len(rows), batch_lines):
+            yield [("|".join(map(str, row)) + "\n").encode() for row in rows[i:i + batch_lines]]
+    return header, batches()
+
+
+def unix_time_of(line, col):
+    return int(line.split(b'|', col + 1)[col])
+
+
+async def replay(header, batches, target, rate=None, speedup=None, burst=None, report_every=5.0, send_header=True):
+    # sends the lines of batches to target paced by rate (rows/s) or speedup (transaction time / wall time)
+    writer = await open_target(target)
+    stats = ReplayStats(report_every)
+    col = header.decode().rstrip('\r\n').split('|').index('unix_time')
+    if send_header:
+        writer.write(header)
+    bucket = TokenBucket(rate, burst) if rate else None
+    first_time = None
+    try:
+        for lines in batches:
+            if bucket is not None:
+                # token bucket: pieces of half the bucket, so tokens refilled while oversleeping are not lost
+                step = max(1, bucket.burst // 2)
+                for i in range(0, len(lines), step):
+                    piece = lines[i:i + step]
+                    await bucket.take(len(piece))
+                    writer.write(b"".join(piece))
+                    await writer.drain()
+                    stats.sent(len(piece), stats.start + (stats.rows + len(piece)) / rate)
+            elif speedup:
+                # accelerated clock: rows due within the next millisecond are sent together
+                if first_time is None:
+                    first_time = unix_time_of(lines[0], col)
+                pending = []
+                for line in lines:
+                    due = stats.start + (unix_time_of(line, col) - first_time) / speedup
+                    wait = due - time.monotonic()
+                    if wait > 0.001:
+                        if pending:
+                            writer.write(b"".join(pending))
+                            await writer.drain()
+                            stats.sent(len(pending), pending_due)
+                            pending = []
+                        await asyncio.sleep(wait)
+                    pending.append(line)
+                    pending_due = due
+                if pending:
+                    writer.write(b"".join(pending))
+                    await writer.drain()
+                    stats.sent(len(pending), pending_due)
+            else:
+                # unpaced: as fast as the target takes it
+                writer.write(b"".join(lines))
+                await writer.drain()
+                stats.sent(len(lines), time.monotonic())
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    stats.report(final=True)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sparkov: replay transactions in unix_time order at a controlled pace')
+    parser.add_argument('inputs', nargs='*', help='Time-ordered csv file (e.g. from datagen.py --merge), or chunk files / output folders to merge first')
+    parser.add_argument('--live', nargs=3, metavar=('NB_CUSTOMERS', 'START_DATE', 'END_DATE'), help='Generate the transactions in-process instead (sorted in memory)')
+    parser.add_argument('-seed', type=int, help='Random generator seed of --live', default=42)
+    parser.add_argument('-s', '--static_merchants', action='store_true', help='Static merchants in --live mode')
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument('--rate', type=float, help='Rows per second', default=None)
+    pace.add_argument('--speedup', type=float, help='Replay transaction time N times faster than the wall clock', default=None)
+    parser.add_argument('--burst', type=int, help='Token bucket size in rows (default: 10ms of --rate)', default=None)
+    parser.add_argument('-t', '--to', help="Target: '-' (stdout), a file path, unix:PATH or tcp:HOST:PORT", default='-')
+    parser.add_argument('--report', type=float, help='Seconds between throughput/lag reports on stderr (0: only at the end)', default=5.0)
+    parser.add_argument('--no_header', action='store_true', help='Do not send the header line')
+
+    args = parser.parse_args()
+    if bool(args.inputs) == bool(args.live):
+        parser.error('give either input files or --live')
+
+    merged = None
+    if args.live:
+        header, batches = live_source(int(args.live[0]), valid_date(args.live[1]), valid_date(args.live[2]),
+                                      seed=args.seed, is_static=args.static_merchants)
+    else:
+        files = []
+        for path in args.inputs:
+            files.extend(chunk_files(path) if os.path.isdir(path) else [path])
+        if len(files) > 1:
+            # several chunks: merge them into one ordered temporary file first
+            fd, merged = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            merge_transactions(files, merged)
+            files = [merged]
+        header, batches = file_source(files[0])
+
+    try:
+        asyncio.run(replay(header, batches, args.to, args.rate, args.speedup, args.burst, args.report, not args.no_header))
+    finally:
+        if merged is not None:
+            os.remove(merged)
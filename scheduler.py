@@ -0,0 +1,110 @@
+### Cost-based task planning for datagen.py.
+### The cost of a customer is estimated from its profile (avg_transactions_per_day x days, more in static mode),
+### customer ranges are cut into tasks of about the same estimated cost, and the tasks are dispatched largest
+### first with imap_unordered, so the workers stay busy until the end of the run. The last tasks to go out
+### are split in two, so no worker is left alone on a big straggler.
+
+import json
+import os
+
+import numpy as np
+
+static_cost_factor = 4.5 # static merchant selection is a per-row loop, ~4-5x slower per transaction (see benchmark.py)
+customer_overhead = 20.0 # fixed cost of a customer (parsing, profile lookup, random streams), in transactions
+tasks_per_worker = 8 # tasks are cut to about 1/(tasks_per_worker * workers) of the total cost
+min_task_cost = 10000.0 # but not smaller than this, below it the per-task overhead (imports, merchants, output file) dominates
+
+
+def profile_costs(profile_dir, profile_names, days, is_static=False):
+    # estimated cost of one customer of each profile, in transactions
+    costs = {}
+    for name in profile_names:
+        with open(os.path.join(profile_dir, name), 'r') as f:
+            per_day = json.load(f)['avg_transactions_per_day']
+        transactions = days * (per_day['min'] + per_day['max']) / 2
+        costs[name] = customer_overhead + transactions * (static_cost_factor if is_static else 1.0)
+    return costs
+
+
+def row_costs(customer_index, costs):
+    # estimated cost of every customer row of the index, 0 for profiles without costs (not generated)
+    per_profile = np.array([costs.get(name, 0.0) for name in customer_index.profiles] + [0.0])
+    return per_profile[customer_index.rows['profile'][:-1]]
+
+
+def cost_ranges(positions, costs, unit):
+    # cuts sorted row positions (with their costs) into contiguous (start row, end row, cost) ranges of about unit
+    if len(positions) == 0:
+        return []
+    cum = np.cumsum(costs)
+    ranges = []
+    start = 0
+    done = 0.0
+    while start < len(positions):
+        end = int(np.searchsorted(cum, done + unit, side='left')) + 1
+        end = min(max(end, start + 1), len(positions))
+        ranges.append((int(positions[start]), int(positions[end - 1]), float(cum[end - 1] - done)))
+        done = float(cum[end - 1])
+        start = end
+    return ranges
+
+
+def fixed_ranges(positions, costs, num_rows, chunk_size):
+    # legacy fixed-size chunks of the customer file, with the cost of the given rows falling in each
+    ranges = []
+    for start in range(0, num_rows, chunk_size):
+        end = min(num_rows - 1, start + chunk_size - 1)
+        lo, hi = np.searchsorted(positions, start, side='left'), np.searchsorted(positions, end, side='right')
+        ranges.append((start, end, float(np.sum(costs[lo:hi]))))
+    return ranges
+
+
+def plan(customer_index, costs, workers, work_units=False, chunk_size=None):
+    # tasks as (profile name or None for work units, start row, end row, estimated cost), largest first.
+    # Profiles smaller than the cost unit get a single task.
+    cost_of_rows = row_costs(customer_index, costs)
+    unit = max(float(cost_of_rows.sum()) / (tasks_per_worker * workers), min_task_cost)
+    if work_units:
+        groups = [(None, np.arange(len(customer_index)))]
+    else:
+        groups = [(name, customer_index.profile_rows(name)) for name in costs]
+    tasks = []
+    for name, positions in groups:
+        if chunk_size:
+            ranges = fixed_ranges(positions, cost_of_rows[positions], len(customer_index), chunk_size)
+        else:
+            ranges = cost_ranges(positions, cost_of_rows[positions], unit)
+        tasks.extend((name, start, end, cost) for start, end, cost in ranges)
+    tasks.sort(key=lambda task: -task[3])
+    return tasks
+
+
+def split_tail(tasks, customer_index, costs, workers, work_units=False):
+    # splits the last `workers` tasks to be dispatched (the smallest ones) in two halves of their cost,
+    # keeping the largest-first order
+    cut = max(len(tasks) - workers, 0)
+    head, tail = tasks[:cut], tasks[cut:]
+    cost_of_rows = row_costs(customer_index, costs)
+    split = []
+    for name, start, end, cost in tail:
+        positions = np.arange(start, end + 1) if work_units else customer_index.profile_rows(name, start, end)
+        if len(positions) < 2 or cost < 2 * min_task_cost:
+            split.append((name, start, end, cost))
+            continue
+        cum = np.cumsum(cost_of_rows[positions])
+        middle = min(max(int(np.searchsorted(cum, cum[-1] / 2, side='left')) + 1, 1), len(positions) - 1)
+        split.append((name, int(positions[0]), int(positions[middle - 1]), float(cum[middle - 1])))
+        split.append((name, int(positions[middle]), int(positions[-1]), float(cum[-1] - cum[middle - 1])))
+    return head + sorted(split, key=lambda task: -task[3])
+
+
+def run_task(task):
+    # imap_unordered entry point: (function, arguments)
+    function, args = task
+    return function(*args)
+
+
+def run_numbered_task(item):
+    # imap_unordered entry point telling which task finished: (task id, (function, arguments)) -> (task id, result)
+    task_id, task = item
+    return task_id, run_task(task)
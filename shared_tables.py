@@ -0,0 +1,53 @@
+### Read-only reference tables shared with the worker processes through multiprocessing.shared_memory.
+### The parent packs named NumPy arrays into one shared block; workers attach to it by name and get views of
+### the arrays, so the tables exist once per machine instead of once per worker, and are not copied or pickled.
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+alignment = 64 # byte alignment of every array in the block
+
+attached = [] # blocks attached by this process, kept open as long as their views may be in use
+
+
+class SharedArrays:
+    # parent side: owns the block, close() it (which also unlinks it) once the workers are done
+
+    def __init__(self, arrays):
+        layout = {}
+        size = 0
+        for name, values in arrays.items():
+            size = -(-size // alignment) * alignment
+            layout[name] = (size, np.asarray(values).dtype, np.shape(values))
+            size += np.asarray(values).nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, values in arrays.items():
+            offset, dtype, shape = layout[name]
+            np.ndarray(shape, dtype, buffer=self.shm.buf, offset=offset)[...] = values
+        self.spec = (self.shm.name, layout) # what workers need to attach, see attach()
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def attach(spec):
+    # worker side: name -> read-only view of the array in the shared block
+    name, layout = spec
+    shm = shared_memory.SharedMemory(name=name)
+    attached.append(shm)
+    arrays = {}
+    for key, (offset, dtype, shape) in layout.items():
+        view = np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        arrays[key] = view
+    return arrays
@@ -0,0 +1,129 @@
+### Buffered text outputs shared by the generators, replacing the sys.stdout redirection.
+### Rows are collected and written in large blocks, optionally through a streaming gzip/lzma/bz2 compressor.
+### Also the atomic (temporary file then rename) writes of the index, manifest and cache files.
+
+import bz2
+import contextlib
+import gzip
+import lzma
+import os
+import shutil
+import sys
+
+compressors = {'gzip': gzip.open, 'lzma': lzma.open, 'bz2': bz2.open}
+extensions = {'gzip': '.gz', 'lzma': '.xz', 'bz2': '.bz2'}
+default_buffer_size = 4 << 20 # characters buffered before a write
+
+
+def compressed_path(path, compression=None):
+    # output path with the extension of the compression, if not already there
+    path = str(path)
+    if compression and not path.endswith(extensions[compression]):
+        path += extensions[compression]
+    return path
+
+
+def detect_compression(path):
+    for compression, ext in extensions.items():
+        if str(path).endswith(ext):
+            return compression
+    return None
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    # file object on a temporary file next to path, renamed over path when the block succeeds: readers (and
+    # concurrent writers of the same file) never see a partial file, and a failed write leaves nothing behind
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def atomic_directory(path):
+    # atomic_write for a directory: yields a temporary directory, which replaces path when the block succeeds
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    try:
+        yield tmp_path
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+
+def existing_path(path):
+    # path, or its compressed variant when only that one was written
+    if not os.path.exists(path):
+        for ext in extensions.values():
+            if os.path.exists(f'{path}{ext}'):
+                return f'{path}{ext}'
+    return path
+
+
+def open_file(path, mode='r', compression=None):
+    # open a plain or compressed file; when reading, the compression is detected from the extension
+    compression = compression or detect_compression(path)
+    opener = compressors[compression] if compression else open
+    if 'b' in mode:
+        return opener(path, mode)
+    return opener(path, mode if 't' in mode else mode + 't', newline='\n')
+
+
+class TextSink:
+    # Writes whole batches of lines with one write() per buffer_size characters.
+    # path=None writes to stdout (which is then flushed, not closed).
+
+    def __init__(self, path=None, compression=None, buffer_size=default_buffer_size):
+        self.path = compressed_path(path, compression) if path is not None else None
+        self.f = open_file(self.path, 'w', compression) if path is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+
+    def writelines(self, lines):
+        # lines must carry their own trailing newline
+        self.pending.extend(lines)
+        self.pending_size += sum(map(len, lines))
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def write(self, line):
+        self.writelines([line])
+
+    def write_row(self, row):
+        self.writelines(["|".join(row) + "\n"])
+
+    def write_transactions(self, cust, cols):
+        # same interface as the columnar writer, see datagen_transaction.Customer.print_trans
+        self.writelines(cust.format_trans(cols))
+
+    def flush(self):
+        if self.pending:
+            self.f.write("".join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+        self.f.flush()
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush()
+        if self.path is not None:
+            self.f.close()
+        self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+
+class GridIndex:
+    # Uniform lat/long grid over a set of points: points are bucketed by cell of cell_size degrees, so a radius
+    # query only measures distances to the points of the cells overlapping the query square.
+
+    def __init__(self, lat, long, cell_size=0.1):
+        self.lat = np.asarray(lat, dtype=float)
+        self.long = np.asarray(long, dtype=float)
+        self.cell_size = cell_size
+        cx = np.floor(self.lat / cell_size).astype(np.int64)
+        cy = np.floor(self.long / cell_size).astype(np.int64)
+        # points sorted by cell, each cell maps to its slice of self.order
+        self.order = np.lexsort((cy, cx))
+        self.cells = {}
+        if len(self.order):
+            keys = np.stack([cx[self.order], cy[self.order]], axis=1)
+            starts = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            bounds = np.concatenate([[0], starts, [len(self.order)]])
+            for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                self.cells[(int(keys[start, 0]), int(keys[start, 1]))] = (start, end)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def candidates(self, lat, long, r):
+        # indices of the points in the cells overlapping the square of side 2r around (lat, long)
+        x0, x1 = math.floor((lat - r) / self.cell_size), math.floor((lat + r) / self.cell_size)
+        y0, y1 = math.floor((long - r) / self.cell_size), math.floor((long + r) / self.cell_size)
+        slices = []
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                bounds = self.cells.get((x, y))
+                if bounds is not None:
+                    slices.append(self.order[bounds[0]:bounds[1]])
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def query(self, lat, long, r):
+        # sorted indices of the points strictly within euclidean distance r (in degrees) of (lat, long)
+        lat, long = float(lat), float(long)
+        idx = self.candidates(lat, long, r)
+        dist = np.sqrt(np.square(self.lat[idx] - lat) + np.square(self.long[idx] - long))
+        return np.sort(idx[dist < r])
+
+    def arrays(self):
+        # the numeric state of the index as named arrays, see from_arrays
+        return {
+            'lat': self.lat,
+            'long': self.long,
+            'order': self.order,
+            'cell_keys': np.array(list(self.cells), dtype=np.int64).reshape(-1, 2),
+            'cell_bounds': np.array(list(self.cells.values()), dtype=np.int64).reshape(-1, 2),
+            'cell_size': np.array([self.cell_size]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # index around existing arrays (e.g. views of shared memory), without sorting the points again
+        grid = cls.__new__(cls)
+        grid.lat, grid.long, grid.order = arrays['lat'], arrays['long'], arrays['order']
+        grid.cell_size = float(arrays['cell_size'][0])
+        grid.cells = {(x, y): (start, end) for (x, y), (start, end) in
+                      zip(arrays['cell_keys'].tolist(), arrays['cell_bounds'].tolist())}
+        return grid
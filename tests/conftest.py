@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+
+@pytest.fixture(autouse=True)
+def in_repo_dir(monkeypatch):
+    # the generators read their reference data (profiles, demographic_stats...) relative to the repository root
+    monkeypatch.chdir(repo_dir)
+
+
+@pytest.fixture
+def datagen(tmp_path):
+    # runs datagen.py in tmp_path (reference data linked in), returns the completed process
+    for name in ['profiles', 'demographic_stats']:
+        os.symlink(os.path.join(repo_dir, name), tmp_path / name)
+    os.makedirs(tmp_path / 'customers_merchants')
+    os.symlink(os.path.join(repo_dir, 'customers_merchants', 'merchants.csv'), tmp_path / 'customers_merchants' / 'merchants.csv')
+
+    def run(*args, check=True):
+        cmd = [sys.executable, os.path.join(repo_dir, 'datagen.py'), *args, '--profile_cache', 'none']
+        process = subprocess.run(cmd, cwd=tmp_path, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        if check and process.returncode != 0:
+            raise AssertionError(f'{" ".join(cmd)} failed:\n{process.stderr}')
+        return process
+    return run
+
+
+def read_outputs(folder, pattern='*.csv*'):
+    # file name -> content of the output files of a run
+    return {path.name: path.read_bytes() for path in sorted(folder.glob(pattern))}
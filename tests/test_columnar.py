@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from columnar import ColumnarWriter, ColumnarReader, read_columnar
+
+schema = [
+    ('amt', 'float'), ('unix_time', 'int'), ('zip', 'int32'), ('is_fraud', 'int8'),
+    ('trans_date', 'date'), ('trans_num', 'text'), ('category', 'dict'),
+]
+
+
+def batch(start, n):
+    return {
+        'amt': np.round(np.arange(start, start + n) * 1.25, 2),
+        'unix_time': np.arange(start, start + n) + 1_700_000_000,
+        'zip': [str(10000 + i) for i in range(start, start + n)], # csv values are strings
+        'is_fraud': [i % 2 for i in range(start, start + n)],
+        'trans_date': [f'2023-01-{i % 28 + 1:02d}' for i in range(start, start + n)],
+        'trans_num': [f'{"ü" * (i % 4)}{i:x}' for i in range(start, start + n)], # varying width, non-ascii
+        'category': ['grocery_pos', 'gas_transport', 'misc_net'][start % 3], # scalar repeated n times
+    }
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'chunk.cols')
+    batches = [batch(0, 5), batch(5, 1), batch(6, 7)]
+    with ColumnarWriter(path, schema) as writer:
+        for b in batches:
+            writer.write(b, len(b['amt']))
+
+    reader = ColumnarReader(path)
+    assert len(reader) == 13
+    assert reader.columns == [name for name, _ in schema]
+    np.testing.assert_array_equal(reader.decode('amt'), np.concatenate([b['amt'] for b in batches]))
+    np.testing.assert_array_equal(reader.decode('unix_time'), np.arange(13) + 1_700_000_000)
+    assert reader.decode('zip').tolist() == list(range(10000, 10013))
+    assert reader['zip'].dtype == np.int32 and reader['is_fraud'].dtype == np.int8
+    assert reader.decode('trans_date').astype(str).tolist() == sum((b['trans_date'] for b in batches), [])
+    assert reader.decode('trans_num').tolist() == sum((b['trans_num'] for b in batches), [])
+    assert reader.decode('category').tolist() == ['grocery_pos'] * 5 + ['misc_net'] + ['grocery_pos'] * 7
+    assert reader['category'].dtype == np.int32
+    assert reader.dictionary('category').tolist() == ['grocery_pos', 'misc_net']
+
+    columns = read_columnar(path)
+    assert isinstance(columns['amt'], np.memmap)
+    assert sorted(columns) == sorted(name for name, _ in schema)
+
+
+def test_empty_chunk(tmp_path):
+    path = str(tmp_path / 'empty.cols')
+    ColumnarWriter(path, schema).close()
+    reader = ColumnarReader(path)
+    assert len(reader) == 0
+    for name, _ in schema:
+        assert len(reader.decode(name)) == 0
+
+
+def test_failed_write_leaves_no_chunk(tmp_path):
+    path = str(tmp_path / 'chunk.cols')
+    with pytest.raises(RuntimeError):
+        with ColumnarWriter(path, schema) as writer:
+            writer.write(batch(0, 3), 3)
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
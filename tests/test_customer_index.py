@@ -0,0 +1,71 @@
+import gzip
+import os
+
+import pytest
+
+from customer_index import CustomerIndexBuilder, build_customer_index, load_customer_index, index_paths
+
+header = 'ssn|first|profile\n'
+profiles = ['adults_2550_female_urban.json', 'young_adults_male_rural.json', 'leftovers.json']
+
+
+def customer_lines(n):
+    return [f'{i:09d}|Name{"é" * (i % 3)}{i}|{profiles[i * 7 % 5 % 3]}\n' for i in range(n)]
+
+
+def write_customers(path, lines, opener=open):
+    # the customer file and its index, the way datagen_customer writes them
+    builder = CustomerIndexBuilder(len(header.encode()))
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write(header)
+        for line in lines:
+            f.write(line)
+            builder.add(line.encode(), line.rstrip('\n').split('|')[-1])
+    builder.save(path)
+
+
+@pytest.mark.parametrize('name, opener', [('customers.csv', open), ('customers.csv.gz', gzip.open)])
+def test_index_round_trip(tmp_path, name, opener):
+    path = str(tmp_path / name)
+    lines = customer_lines(50)
+    write_customers(path, lines, opener)
+
+    index = load_customer_index(path)
+    assert len(index) == 50
+    assert index.read_rows(0, 49) == lines
+    assert index.read_rows(10, 20) == lines[10:21]
+    assert index.read_rows(45, 100) == lines[45:]
+    assert index.read_rows(30, 29) == []
+    for profile in profiles:
+        expected = [line for line in lines[5:40] if line.rstrip('\n').endswith(profile)]
+        assert index.read_rows(5, 39, profile) == expected
+    assert index.read_rows(0, 49, 'unknown.json') == []
+    assert sum(index.profile_counts().values()) == 50
+
+
+def test_scanned_index_matches_the_written_one(tmp_path):
+    path = str(tmp_path / 'customers.csv')
+    write_customers(path, customer_lines(30))
+    written = load_customer_index(path).rows.tolist()
+    for p in index_paths(path):
+        os.remove(p)
+    build_customer_index(path)
+    assert load_customer_index(path).rows.tolist() == written
+
+
+def test_rewritten_file_of_the_same_size_is_reindexed(tmp_path):
+    path = str(tmp_path / 'customers.csv')
+    lines = customer_lines(20)
+    write_customers(path, lines)
+    stat = os.stat(path)
+
+    # same length rows, other profiles, and the old modification time: only the content differs
+    swapped = [line.replace(profiles[0], profiles[0].replace('female', 'zemale')) for line in lines]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(header + ''.join(swapped))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(path).st_size == stat.st_size
+
+    index = load_customer_index(path)
+    assert index.read_rows(0, 19) == swapped
+    assert profiles[0] not in index.profiles
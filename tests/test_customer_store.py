@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+import datagen_customer
+from customer_index import load_customer_index
+from customer_store import load_customer_store, build_customer_store, store_paths, columns
+
+config = 'profiles/main_config.json'
+
+
+@pytest.fixture(params=[None, 16])
+def customer_file(request, tmp_path):
+    # customers written with their store, row by row or in batches
+    path = str(tmp_path / 'customers.csv')
+    datagen_customer.main(70, 11, config, path, batch_size=request.param, store=True)
+    return path
+
+
+def test_store_round_trip(customer_file):
+    store = load_customer_store(customer_file)
+    index = load_customer_index(customer_file)
+    assert len(store) == len(index) == 70
+    expected = [tuple(line.rstrip('\n').split('|')) for line in index.read_rows(0, 69)]
+    assert store.read_rows(0, 69) == expected
+    assert store.read_rows(12, 40) == expected[12:41]
+    assert store.read_rows(60, 100) == expected[60:]
+    assert store.read_rows(5, 4) == []
+
+    for profile in index.profiles:
+        rows = [tuple(line.rstrip('\n').split('|')) for line in index.read_rows(3, 50, profile)]
+        assert store.read_rows(3, 50, profile) == rows
+        np.testing.assert_array_equal(store.profile_rows(profile, 3, 50), index.profile_rows(profile, 3, 50))
+
+    # typed columns agree with their text
+    assert store.rows['lat'].tolist() == [float(row[columns.index('lat')]) for row in expected]
+    assert store.rows['city_pop'].tolist() == [int(row[columns.index('city_pop')]) for row in expected]
+    assert store.rows['dob'].astype(str).tolist() == [row[columns.index('dob')] for row in expected]
+
+
+def test_store_built_from_the_file_matches_the_written_one(customer_file):
+    written = load_customer_store(customer_file).read_rows(0, 69)
+    for path in store_paths(customer_file).values():
+        os.remove(path)
+    assert load_customer_store(customer_file) is None
+    build_customer_store(customer_file)
+    assert load_customer_store(customer_file).read_rows(0, 69) == written
+
+
+def test_stale_store_is_not_loaded(customer_file):
+    stat = os.stat(customer_file)
+    with open(customer_file, 'r') as f:
+        text = f.read()
+    # same size and modification time, other content
+    with open(customer_file, 'w') as f:
+        f.write(text.replace('|M|', '|X|').replace('|F|', '|M|').replace('|X|', '|F|'))
+    os.utime(customer_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_customer_store(customer_file) is None
+
+
+def test_rewriting_customers_without_a_store_removes_it(customer_file):
+    datagen_customer.main(10, 1, config, customer_file)
+    assert not any(os.path.exists(path) for path in store_paths(customer_file).values())
+    assert load_customer_store(customer_file) is None
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import identity_pools
+from identity_pools import IdentityPools, unique_fields
+
+
+@pytest.fixture
+def small_pools(monkeypatch):
+    # pools of the requested size instead of multiples of 100000, to keep the Faker builds short
+    monkeypatch.setattr(identity_pools, 'round_up', lambda n: n)
+
+
+def test_pools_round_trip_through_the_disk_cache(tmp_path, small_pools):
+    built = IdentityPools(50, seed=3, path=tmp_path, sample_size=40)
+    values = {field: np.array(built.get(field)) for field in list(unique_fields) + ['last', 'company']}
+
+    loaded = IdentityPools(50, seed=3, path=tmp_path, sample_size=40)
+    for field, expected in values.items():
+        pool = loaded.get(field)
+        assert isinstance(pool, np.memmap)
+        np.testing.assert_array_equal(pool, expected)
+    assert not list(tmp_path.rglob('*.tmp'))
+
+
+def test_unique_fields_are_unique_and_never_handed_out_twice(tmp_path, small_pools):
+    pools = IdentityPools(30, seed=1, path=tmp_path, sample_size=10)
+    first, second = pools.take_unique(20), pools.take_unique(10)
+    for field in unique_fields:
+        values = np.concatenate([first[field], second[field]])
+        assert len(set(values.tolist())) == 30
+    with pytest.raises(ValueError):
+        pools.take_unique(1)
+
+
+def test_a_bigger_cached_pool_is_reused(tmp_path, small_pools):
+    big = IdentityPools(60, seed=5, path=tmp_path, sample_size=10)
+    big.take_unique(1)
+    assert IdentityPools(20, seed=5, path=tmp_path, sample_size=10).unique_size == 60
+    assert IdentityPools(20, seed=6, path=tmp_path, sample_size=10).unique_size == 20
+
+
+def test_sampling_is_seeded(tmp_path, small_pools):
+    a = IdentityPools(10, seed=2, path=tmp_path, sample_size=25).sample('job', 100)
+    b = IdentityPools(10, seed=2, path=tmp_path, sample_size=25).sample('job', 100)
+    np.testing.assert_array_equal(a, b)
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from main_config import MainConfig
+
+
+def linear_scan(config_path, gender, age, city_pop):
+    # the profile lookup before MainConfig.compile: the first profile of the config that matches, -1 meaning no max
+    with open(config_path, 'r') as f:
+        profiles = json.load(f)
+    for name, p in profiles.items():
+        if name == 'leftovers.json':
+            continue
+        if (gender in p['gender']
+                and age >= p['age']['min'] and (age < p['age']['max'] or p['age']['max'] == -1)
+                and city_pop >= p['city_pop']['min'] and (city_pop < p['city_pop']['max'] or p['city_pop']['max'] == -1)):
+            return name
+    return 'leftovers.json'
+
+
+def profile(gender, ages, pops):
+    return {'gender': gender, 'age': {'min': ages[0], 'max': ages[1]}, 'city_pop': {'min': pops[0], 'max': pops[1]}}
+
+
+# overlapping profiles (the first one wins), a gap in ages and populations, a profile for both genders
+overlapping_config = {
+    'teens_any.json': profile('MF', (0, 18), (0, -1)),
+    'young_male_city.json': profile('M', (15, 30), (5000, -1)),
+    'young_female.json': profile('F', (15, 40.5), (0, 100000)),
+    'old_male.json': profile('M', (40, -1), (0, 2500)),
+    'old_female.json': profile('F', (45, 80), (2500, -1)),
+    'leftovers.json': profile('MF', (0, -1), (0, -1)),
+}
+
+
+@pytest.fixture(params=['main', 'overlapping'])
+def config_path(request, tmp_path):
+    if request.param == 'main':
+        return 'profiles/main_config.json'
+    path = tmp_path / 'main_config.json'
+    path.write_text(json.dumps(overlapping_config))
+    return str(path)
+
+
+def test_compiled_lookup_matches_the_linear_scan(config_path):
+    config = MainConfig(config_path)
+    ages = [-1, 0, 0.5, 14.99, 15, 17.9, 18, 24.999, 25, 29, 30, 39, 40, 40.5, 41, 44.9, 45, 49.99, 50, 79, 80, 81, 120]
+    pops = [0, 1, 2499, 2500, 2501, 4999, 5000, 99999, 100000, 100001, 10**7]
+    customers = [(g, a, c) for g in ('M', 'F', 'X') for a in ages for c in pops]
+    expected = [linear_scan(config_path, *customer) for customer in customers]
+    assert [config.match(*customer) for customer in customers] == expected
+    assert config.assign(*zip(*customers)) == expected
+
+
+def test_overlaps_and_gaps_are_reported(tmp_path):
+    path = tmp_path / 'main_config.json'
+    path.write_text(json.dumps(overlapping_config))
+    config = MainConfig(str(path))
+    assert ['teens_any.json', 'young_male_city.json'] in [names for names, *_ in config.overlaps]
+    assert ('M', (30.0, 40.0), (0.0, 2500.0)) in config.gaps
+    assert not MainConfig('profiles/main_config.json').overlaps
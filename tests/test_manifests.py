@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from conftest import read_outputs
+from manifests import merge_manifests, parse_shard, shard_tasks
+
+dates = ('01-01-2023', '02-15-2023')
+customers = 'customers_merchants/customers.csv'
+
+
+def test_parse_shard():
+    assert parse_shard('1/4') == (1, 4)
+    assert [task_id for task_id, _ in shard_tasks(list('abcdefg'), (1, 3))] == [1, 4]
+
+
+@pytest.fixture
+def shards(datagen, tmp_path):
+    # the same run as two shards and on a single node
+    datagen('-n', '60', '-seed', '5', *dates, '-o', 'shard0', '--shard', '0/2', '-w', '--chunk_size', '10')
+    datagen('-c', customers, '-seed', '5', *dates, '-o', 'shard1', '--shard', '1/2', '-w', '--chunk_size', '10')
+    datagen('-c', customers, '-seed', '5', *dates, '-o', 'single', '-w', '--chunk_size', '10', '--workers', '2')
+    return tmp_path
+
+
+def test_shards_add_up_to_a_single_run(shards):
+    index = merge_manifests([str(shards / 'shard0'), str(shards / 'shard1')], str(shards / 'dataset_index.json'), verify=True)
+    assert index['shards'] == 2
+    assert json.loads((shards / 'dataset_index.json').read_text()) == index
+
+    single = read_outputs(shards / 'single')
+    sharded = {**read_outputs(shards / 'shard0'), **read_outputs(shards / 'shard1')}
+    assert len(single) == 6 and read_outputs(shards / 'shard1')
+    assert sharded == single
+    assert sorted(entry['path'].split('/')[-1] for entry in index['files']) == sorted(single)
+    assert index['rows'] == sum(content.count(b'\n') - 1 for content in single.values())
+
+
+def test_missing_shard_or_changed_file_is_reported(shards):
+    with pytest.raises(ValueError, match=r'missing shards: \[1\]'):
+        merge_manifests([str(shards / 'shard0')], str(shards / 'dataset_index.json'))
+
+    chunk = sorted((shards / 'shard1').glob('*.csv'))[0]
+    chunk.write_bytes(chunk.read_bytes()[:-1])
+    with pytest.raises(ValueError, match=chunk.name):
+        merge_manifests([str(shards / 'shard0'), str(shards / 'shard1')], str(shards / 'dataset_index.json'))
+    assert not (shards / 'dataset_index.json').exists()
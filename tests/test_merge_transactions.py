@@ -0,0 +1,66 @@
+import gzip
+import os
+import random
+
+import pytest
+
+from merge_transactions import merge_transactions, chunk_files
+
+header = 'cc_num|trans_num|unix_time|amt\n'
+
+
+def write_chunks(folder, n_chunks=7, rows=60, seed=1):
+    # chunks of unsorted rows with many equal unix_times, one of them gzip compressed and one empty
+    rand = random.Random(seed)
+    rows_all = []
+    paths = []
+    for c in range(n_chunks):
+        lines = [f'{rand.randint(1, 99)}|{c}-{i}|{rand.randint(1_672_531_200, 1_672_531_260)}|{rand.random():.2f}\n'
+                 for i in range(0 if c == 3 else rows)]
+        path = os.path.join(folder, f'chunk{c}.csv' + ('.gz' if c == 1 else ''))
+        with (gzip.open if c == 1 else open)(path, 'wt') as f:
+            f.write(header + ''.join(lines))
+        rows_all.extend(lines)
+        paths.append(path)
+    return paths, rows_all
+
+
+def expected_order(lines):
+    return sorted(lines, key=lambda line: (int(line.split('|')[2]), line.encode()))
+
+
+@pytest.mark.parametrize('fan_in, ranges, compression', [(64, 1, None), (2, 1, None), (3, 4, None), (2, 3, 'gzip')])
+def test_rows_are_merged_in_unix_time_order(tmp_path, fan_in, ranges, compression):
+    paths, lines = write_chunks(tmp_path)
+    assert sorted(chunk_files(tmp_path)) == sorted(paths)
+    out = str(tmp_path / 'out' / 'sorted.csv')
+    os.makedirs(os.path.dirname(out))
+    assert merge_transactions(paths, out, fan_in=fan_in, ranges=ranges, workers=2, compression=compression) == len(lines)
+
+    out_path = out + '.gz' if compression else out
+    with (gzip.open if compression else open)(out_path, 'rt') as f:
+        merged = f.readlines()
+    assert merged[0] == header
+    assert merged[1:] == expected_order(lines)
+    # nothing left behind but the merged file
+    assert os.listdir(os.path.dirname(out)) == [os.path.basename(out_path)]
+
+
+def test_output_does_not_depend_on_fan_in_or_ranges(tmp_path):
+    paths, _ = write_chunks(tmp_path, n_chunks=5, rows=200, seed=9)
+    outputs = []
+    for fan_in, ranges in ((64, 1), (2, 5)):
+        out = str(tmp_path / f'sorted_{fan_in}_{ranges}.csv')
+        merge_transactions(paths, out, fan_in=fan_in, ranges=ranges, workers=2)
+        with open(out, 'rb') as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
+
+
+def test_chunks_with_other_columns_are_rejected(tmp_path):
+    paths, _ = write_chunks(tmp_path, n_chunks=2)
+    other = str(tmp_path / 'other.csv')
+    with open(other, 'w') as f:
+        f.write('unix_time|amt\n1|2.0\n')
+    with pytest.raises(ValueError):
+        merge_transactions(paths + [other], str(tmp_path / 'sorted.csv'), workers=1)
@@ -0,0 +1,36 @@
+import json
+import time as time_module
+from datetime import datetime, time
+
+import numpy as np
+import pytest
+
+from profile_weights import Profile
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time_module.tzset()
+    yield
+    monkeypatch.undo()
+    time_module.tzset()
+
+
+def test_unix_time_matches_local_datetime_across_dst(new_york):
+    with open('profiles/adults_2550_female_urban.json') as f:
+        profile = Profile(json.load(f), use_cache=False)
+    rng = np.random.default_rng(0)
+    transition_rows = 0
+    for start, end in [(datetime(2023, 3, 10), datetime(2023, 3, 14)), (datetime(2023, 11, 3), datetime(2023, 11, 7))]:
+        profile.set_date_range(start, end)
+        for _ in range(20):
+            cols = profile.sample_from(0, rng)[0]
+            days = cols['trans_date'].tolist()
+            expected = [
+                int(datetime.combine(d, time(h, m, s)).timestamp())
+                for d, h, m, s in zip(days, cols['hour'].tolist(), cols['minute'].tolist(), cols['second'].tolist())
+            ]
+            assert cols['unix_time'].tolist() == expected
+            transition_rows += sum(d.day in (12, 5) for d in days)
+    assert transition_rows > 0
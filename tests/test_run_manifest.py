@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+
+from conftest import read_outputs
+from manifests import RUN_MANIFEST_VERSION, load_run_manifest, write_run_manifest, task_done, file_entry, run_manifest_name
+
+run = ('-seed', '3', '-o', 'out', '-w', '--chunk_size', '10')
+
+
+def test_run_manifest_round_trip(tmp_path):
+    path = str(tmp_path / run_manifest_name())
+    assert load_run_manifest(path) is None
+    chunk = tmp_path / 'transactions_0-9.csv'
+    chunk.write_text('unix_time\n1\n2\n')
+    manifest = {'version': RUN_MANIFEST_VERSION, 'windows': [], 'completed': {'0': [file_entry(str(chunk), str(tmp_path), 0)]}}
+    write_run_manifest(path, manifest)
+    assert load_run_manifest(path) == manifest
+    assert sorted(os.listdir(tmp_path)) == [run_manifest_name(), chunk.name] # no temporary file left
+
+    assert task_done(manifest, 0, str(tmp_path))
+    assert not task_done(manifest, 1, str(tmp_path))
+    chunk.write_text('unix_time\n1\n') # truncated by a crash
+    assert not task_done(manifest, 0, str(tmp_path))
+    chunk.unlink()
+    assert not task_done(manifest, 0, str(tmp_path))
+
+    write_run_manifest(path, {**manifest, 'version': RUN_MANIFEST_VERSION + 1})
+    with pytest.raises(ValueError):
+        load_run_manifest(path)
+    assert run_manifest_name((1, 4)) == 'run_manifest_shard1-of-4.json'
+
+
+def test_resume_only_runs_the_missing_tasks(datagen, tmp_path):
+    datagen('-n', '60', '01-01-2023', '02-15-2023', *run)
+    out = tmp_path / 'out'
+    complete = read_outputs(out)
+    assert len(complete) == 6
+    manifest = json.loads((out / 'run_manifest.json').read_text())
+    assert sorted(manifest['completed']) == [str(i) for i in range(6)]
+
+    # a crashed run: one task never finished, another one left a truncated file
+    names = sorted(complete)
+    (out / names[0]).unlink()
+    (out / names[1]).write_bytes(complete[names[1]][:10])
+    mtimes = {name: os.stat(out / name).st_mtime_ns for name in names[2:]}
+    process = datagen('--resume', *run)
+    assert 'resuming: 4 of 6 tasks already completed' in process.stdout
+    assert read_outputs(out) == complete
+    assert {name: os.stat(out / name).st_mtime_ns for name in names[2:]} == mtimes
+
+
+def test_resume_refuses_other_options(datagen):
+    datagen('-n', '20', '01-01-2023', '01-31-2023', *run)
+    assert 'different static_merchants' in datagen('--resume', *run, '-s', check=False).stderr
+    assert 'written for 2023-01-01 - 2023-01-31' in datagen('--resume', '01-01-2023', '02-28-2023', *run, check=False).stderr
+    assert 'no run manifest' in datagen('--resume', '-seed', '3', '-o', 'other', check=False).stderr
+
+
+def test_extend_to_adds_a_window(datagen, tmp_path):
+    datagen('-n', '30', '01-01-2023', '01-31-2023', *run)
+    out = tmp_path / 'out'
+    first = read_outputs(out)
+
+    datagen('--extend-to', '03-15-2023', *run)
+    extended = read_outputs(out)
+    added = {name: content for name, content in extended.items() if name not in first}
+    assert {name: extended[name] for name in first} == first
+    assert sorted(name.replace('_20230201-20230315', '') for name in added) == sorted(first)
+
+    manifest = json.loads((out / 'run_manifest.json').read_text())
+    assert [(w['start_date'], w['end_date']) for w in manifest['windows']] == [('2023-01-01', '2023-01-31'), ('2023-02-01', '2023-03-15')]
+    assert len(manifest['completed']) == 2 * len(first)
+    for content in added.values():
+        lines = content.decode().splitlines()
+        date_col = lines[0].split('|').index('trans_date')
+        assert all('2023-02-01' <= line.split('|')[date_col] <= '2023-03-15' for line in lines[1:])
+
+    # the same extension again is a plain resume, a too short one is refused
+    assert 'resuming: 6 of 6 tasks already completed' in datagen('--extend-to', '03-15-2023', *run).stdout
+    assert read_outputs(out) == extended
+    assert 'at least 9 days' in datagen('--extend-to', '03-20-2023', *run, check=False).stderr
+
+
+def test_resume_refuses_reference_files_rewritten_with_the_same_size(datagen, tmp_path):
+    datagen('-n', '20', '01-01-2023', '01-31-2023', *run, '-s')
+    for name in ('customers.csv', 'merchants_static.csv'):
+        path = tmp_path / 'customers_merchants' / name
+        content = path.read_bytes()
+        stat = os.stat(path)
+        lines = content.splitlines(keepends=True)
+        path.write_bytes(lines[0] + b''.join(reversed(lines[1:])))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert 'changed since the recorded run' in datagen('--resume', *run, '-s', check=False).stderr
+        path.write_bytes(content)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert 'resuming: 2 of 2 tasks already completed' in datagen('--resume', *run, '-s').stdout
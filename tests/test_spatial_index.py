@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from spatial_index import GridIndex
+
+
+def brute_force(lat, long, qlat, qlong, r):
+    return np.flatnonzero(np.sqrt(np.square(lat - qlat) + np.square(long - qlong)) < r)
+
+
+@pytest.mark.parametrize('cell_size', [0.1, 0.37, 2.0])
+def test_query_matches_brute_force(cell_size):
+    rng = np.random.default_rng(7)
+    # clustered points around a few cities, plus negative coordinates and points on cell boundaries
+    centers = rng.uniform([-40, -120], [60, 80], size=(8, 2))
+    points = np.concatenate([c + rng.normal(0, 0.3, size=(300, 2)) for c in centers])
+    points = np.concatenate([points, np.round(points[:50], 1)])
+    lat, long = points[:, 0], points[:, 1]
+    grid = GridIndex(lat, long, cell_size)
+    assert len(grid) == len(points)
+
+    queries = np.concatenate([points[rng.integers(0, len(points), 100)], rng.uniform([-40, -120], [60, 80], size=(20, 2))])
+    for qlat, qlong in queries:
+        for r in (0.05, 0.1, 0.5, 1.3):
+            np.testing.assert_array_equal(grid.query(qlat, qlong, r), brute_force(lat, long, qlat, qlong, r))
+
+
+def test_rebuilt_from_arrays():
+    rng = np.random.default_rng(3)
+    lat, long = rng.uniform(30, 31, 500), rng.uniform(-90, -89, 500)
+    grid = GridIndex(lat, long)
+    copy = GridIndex.from_arrays({name: np.array(a) for name, a in grid.arrays().items()})
+    for qlat, qlong in zip(lat[:50], long[:50]):
+        np.testing.assert_array_equal(copy.query(qlat, qlong, 0.1), grid.query(qlat, qlong, 0.1))
+
+
+def test_empty_index():
+    grid = GridIndex([], [])
+    assert len(grid.query(40.0, -75.0, 0.5)) == 0
+    assert len(GridIndex.from_arrays(grid.arrays()).query(40.0, -75.0, 0.5)) == 0
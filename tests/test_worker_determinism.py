@@ -0,0 +1,18 @@
+import pytest
+
+from conftest import read_outputs
+
+
+@pytest.mark.parametrize('mode', [[], ['-w'], ['-s', '-b', '100', '--merchant_batch']])
+def test_output_does_not_depend_on_the_number_of_workers(datagen, tmp_path, mode):
+    outputs = []
+    for workers in (1, 3):
+        datagen('-n', '40', '-seed', '7', '01-01-2023', '02-15-2023', '-o', f'out{workers}', '--workers', str(workers),
+                '--chunk_size', '7' if workers == 1 else '13', *mode)
+        outputs.append(read_outputs(tmp_path / f'out{workers}'))
+        (tmp_path / 'customers_merchants' / 'customers.csv').unlink()
+    assert outputs[0]
+    # the chunks are cut differently: compare the rows of all the chunks
+    rows = [sorted(line for content in out.values() for line in content.splitlines()[1:]) for out in outputs]
+    assert rows[0] == rows[1]
+    assert len(rows[0]) > 100
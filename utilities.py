@@ -1,5 +1,8 @@
 from datetime import datetime
 import math, random, argparse
+import numpy as np
+
+attraction = 3  # play with this value (density, https://stackoverflow.com/questions/66829191/how-to-generate-random-points-within-a-circular-area-with-higher-density-near-t)
 
 def valid_date(s):
     try:
@@ -8,15 +11,19 @@ def valid_date(s):
         msg = "not a valid date: {0!r}".format(s)
         raise argparse.ArgumentTypeError(msg)
 
-def randomize_coordinate(lat, long, radius):
-    # Randomize coordinate for the customers
+def randomize_coordinate(lat, long, radius, rand=random):
+    # Randomize coordinate for the customers (rand: a random.Random, the random module by default)
     lat = float(lat)
     long = float(long)
-    attraction = 3  # play with this value (density, https://stackoverflow.com/questions/66829191/how-to-generate-random-points-within-a-circular-area-with-higher-density-near-t)
-    t = random.random() * 2 * math.pi
-    r = random.random() ** attraction * radius  
+    t = rand.random() * 2 * math.pi
+    r = rand.random() ** attraction * radius  
     new_lat = lat + r * math.sin(t)
     new_long = long + r * math.cos(t)
 
     return str(new_lat), str(new_long)
-    
\ No newline at end of file
+    
+def randomize_coordinates(lat, long, radius, rng):
+    # Vectorized randomize_coordinate: 'shake' arrays of coordinates at once with the same density
+    t = rng.random(len(lat)) * 2 * math.pi
+    r = rng.random(len(lat)) ** attraction * radius
+    return lat + r * np.sin(t), long + r * np.cos(t)